@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# Compare forecast providers for the f_forecast feature: DataSet build wall time and model alpha
+import os, sys, argparse
+from time import perf_counter
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/..')
+from lightgbm import LGBMRegressor
+from dataset import DataSet, model_input
+from lib.forecast import FORECASTERS
+from lib.evaluation import alpha
+import lib.tickers as ticker_lists
+import lib.storage as storage
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', '--markets', default='AU', help='Comma-separated list of markets. Default : AU')
+parser.add_argument('-s', '--split-date', default='2016-01-01', help='Train/Test split date. Default : 2016-01-01')
+parser.add_argument('-w', '--resample', default='W-FRI', help='Resampling window size. Default: W-FRI')
+parser.add_argument('-k', '--backend', default=storage.DEFAULT_BACKEND, choices=storage.BACKENDS.keys(), help='Storage backend. Default: $STOX_BACKEND or sql')
+parser.add_argument('-n', '--forecasters', default=','.join(FORECASTERS), help=f"Comma-separated list of forecasters to compare. Default: {','.join(FORECASTERS)}")
+
+MARKETS = parser.parse_args().markets
+SPLIT_DATE = parser.parse_args().split_date
+RESAMPLE = parser.parse_args().resample
+FORECASTER_NAMES = parser.parse_args().forecasters.split(',')
+
+storage.use(parser.parse_args().backend)
+TICKERS = ticker_lists.by_market(MARKETS.split(','))
+
+print('forecaster', 'build seconds', 'alpha', sep='\t')
+for name in FORECASTER_NAMES:
+    time_start = perf_counter()
+    ds = DataSet(tickers=TICKERS, lookback=6, lookfwd=1, split_date=SPLIT_DATE, resample=RESAMPLE, forecaster=name)
+    build_time = perf_counter() - time_start
+
+    model = LGBMRegressor(objective='mae', n_estimators=200, learning_rate=0.05, num_leaves=47, random_state=6, verbose=-1)
+    model.fit(model_input(ds.train, ds.lags, ds.market_features), ds.train['future'])
+    print(name, round(build_time, 1), round(alpha(ds.test['future'], model.predict(model_input(ds.test, ds.lags, ds.market_features))), 2), sep='\t')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Time DataSet construction, training and predicting on synthetic markets of increasing size, and log the timings per commit
+import os, sys, argparse, datetime
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/..')
+import pandas as pd
+from lightgbm import LGBMRegressor
+from dataset import DataSet, model_input
+from lib.evaluation import alpha, score_predictors
+from lib.profiling import Profile
+import lib.synthetic as synthetic
+import lib.tickers as ticker_lists
+import lib.storage as storage
+import lib.dumps as dumps
+
+BASE_DIR = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + '/..')
+TIMESTAMP = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+pd.set_option('mode.chained_assignment', None)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--tickers', default='100,1000,10000', help='Comma-separated numbers of tickers to time the pipeline with. Default: 100,1000,10000')
+parser.add_argument('-d', '--days', default=2520, help='Number of trading days of synthetic data for each ticker. Default: 2520, about 10 years')
+parser.add_argument('-e', '--end', default=synthetic.END, help=f'Last day of the synthetic data. Default: {synthetic.END}')
+parser.add_argument('-g', '--kind', default='market', choices=synthetic.KINDS, help="Synthetic data: 'market' (tickers following an index, with listings, gaps and missing bars), 'easy' or 'hard' (the predictable and unpredictable series of lib/old/mock.py). Default: market")
+parser.add_argument('-r', '--seed', default=synthetic.SEED, help=f'Seed of the synthetic data and the model. Default: {synthetic.SEED}')
+parser.add_argument('-w', '--resample', default='W-FRI', help='Resampling window size. Default: W-FRI')
+parser.add_argument('-b', '--lookback', default=6, help='The number of periods for look-back features. Default: 6.')
+parser.add_argument('-f', '--lookfwd', default=1, help='The number of periods into the future to predict at. Default: 1.')
+parser.add_argument('-t', '--size', default=200, help='Number of estimator trees to build. Default: 200.')
+parser.add_argument('-o', '--store', default=BASE_DIR + '/data/synthetic', help='Directory to keep the synthetic stores in, one for each panel, reused by later runs. Default: data/synthetic')
+parser.add_argument('-l', '--log', default=BASE_DIR + '/results/benchmarks.csv', help='CSV file the timings are appended to. Default: results/benchmarks.csv')
+parser.add_argument('-c', '--compare', default=None, help='Commit to compare the timings with. Default: the last run with the same settings')
+
+SIZES = [ int(n) for n in parser.parse_args().tickers.split(',') ]
+DAYS = int(parser.parse_args().days)
+END = parser.parse_args().end
+KIND = parser.parse_args().kind
+SEED = int(parser.parse_args().seed)
+RESAMPLE = parser.parse_args().resample
+LOOKBACK = int(parser.parse_args().lookback)
+LOOKFWD = int(parser.parse_args().lookfwd)
+SIZE = int(parser.parse_args().size)
+STORE = parser.parse_args().store
+LOG = parser.parse_args().log
+COMPARE = parser.parse_args().compare
+
+MARKET = 'SY'
+SPLIT_DATE = (pd.Timestamp(END) - pd.offsets.BDay(DAYS // 5)).date().isoformat() # test on the last fifth of the days
+MIN_TEST_SAMPLES = 10
+LGB_params = {  'colsample_bytree': 0.8, 'learning_rate': 0.05, 'objective': 'mae',
+                'min_child_samples': 22, 'min_child_weight': 0.0001,
+                'num_leaves': 47, 'reg_alpha': 0.01, 'reg_lambda': 0.01 } # as stox's
+SETTINGS = {    'kind': KIND, 'days': DAYS, 'end': END, 'seed': SEED, 'resample': RESAMPLE,
+                'lookback': LOOKBACK, 'lookfwd': LOOKFWD, 'size': SIZE }
+
+def panel(n, profile):
+    """ Directory of the store with the synthetic panel of n tickers, generated into it first if it isn't there """
+    directory = f'{STORE}/{KIND}-{n}x{DAYS}-{END}-{SEED}'
+    if not os.path.isdir(directory):
+        with profile.stage('generate'):
+            synthetic.write(storage.ArrowStore(directory + '.tmp'), MARKET, n, DAYS, END, KIND, SEED)
+        os.rename(directory + '.tmp', directory) # only complete panels are reused
+    return directory
+
+def run(n):
+    """ Time each stage of the pipeline on the panel of n tickers. Returns the per-stage summary, the model's alpha and the number of samples. """
+    profile = Profile()
+    storage.use('arrow', panel(n, profile))
+    tickers = ticker_lists.by_market([ MARKET ])
+
+    with profile.stage('dataset'):
+        ds = DataSet(tickers=tickers, lookback=LOOKBACK, lookfwd=LOOKFWD, split_date=SPLIT_DATE, resample=RESAMPLE, keep_predictors=True, profile=profile)
+    with profile.stage('model_input'):
+        X_train = model_input(ds.train, ds.lags, ds.market_features)
+        X_test = model_input(ds.test, ds.lags, ds.market_features)
+    y_train, y_test = ds.train['future'], ds.test['future']
+    predictors = X_test[y_test.isnull()]
+    predictors_latest = predictors.index.get_level_values('date').max()
+    X_test, y_test = X_test[y_test.notnull()], y_test[y_test.notnull()]
+
+    model = LGBMRegressor(**LGB_params, n_estimators=SIZE, random_state=SEED, verbose=-1)
+    with profile.stage('train'):
+        model.fit(X_train, y_train)
+    with profile.stage('predict'):
+        predictions = model.predict(X_test)
+    with profile.stage('score'):
+        score_predictors(predictors, predictors_latest, y_test, predictions, model, MIN_TEST_SAMPLES, verbose=0)
+    return profile.summary(), alpha(y_test, predictions), len(X_train) + len(X_test)
+
+log = [ ]
+for n in SIZES:
+    summary, model_alpha, samples = run(n)
+    print(f'\n{n} tickers, {samples} samples, alpha: {model_alpha:.2f}')
+    print(summary.round(3).to_string())
+    log.append(summary.reset_index().assign(timestamp=TIMESTAMP, code_version=dumps.code_version(), tickers=n,
+                                            samples=samples, alpha=model_alpha, **SETTINGS))
+
+log = pd.concat(log)[[ 'timestamp', 'code_version', 'tickers', *SETTINGS, 'samples', 'alpha', 'stage', 'runs', 'seconds', 'peak_rss_mb' ]]
+previous = pd.read_csv(LOG, dtype=str) if os.path.exists(LOG) else None
+log.to_csv(LOG, mode='a', header=previous is None, index=False)
+print('\ntimings appended to', LOG)
+
+# compare with the last run before this one with the same settings and some of the same numbers of tickers, or the last one with the given commit
+if previous is not None:
+    same = (previous[list(SETTINGS)] == pd.Series({ k: str(v) for k, v in SETTINGS.items() })).all(axis=1)
+    same &= previous['tickers'].astype(int).isin(SIZES)
+    if COMPARE is not None:
+        same &= previous['code_version'] == COMPARE
+    if same.any():
+        baseline = previous[same & (previous['timestamp'] == previous.loc[same, 'timestamp'].max())]
+        seconds = lambda runs: runs.astype({ 'tickers': int, 'seconds': float }).pivot_table(index='stage', columns='tickers', values='seconds', sort=False)
+        now, then = seconds(log), seconds(baseline)
+        now = now[[ n for n in now.columns if n in then.columns ]] # only the numbers of tickers both runs timed
+        print(f"\nseconds now / at {baseline['code_version'].iloc[0]} ({baseline['timestamp'].iloc[0]}), by number of tickers:")
+        print((now / then.reindex(index=now.index, columns=now.columns)).round(2).to_string())
+    else:
+        print('\nno earlier run' + (f' at {COMPARE}' if COMPARE is not None else '') + ' with the same settings and any of these numbers of tickers to compare with')
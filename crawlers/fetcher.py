@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Concurrent, rate limited fetching of ticker histories, with retries
+
+import itertools, random, threading, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class TokenBucket:
+    """ Lets through rate requests per second on average, in bursts of up to burst requests, across all threads """
+    def __init__(self, rate, burst=1):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = burst, time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Throttled:
+    """ A source whose requests each take a token from the bucket first """
+    def __init__(self, source, bucket):
+        self.source, self.bucket = source, bucket
+
+    def history(self, ticker, start=None):
+        self.bucket.acquire()
+        return self.source.history(ticker, start)
+
+def with_retries(function, attempts=3, backoff=2.0):
+    """ function, retried on exceptions after exponentially growing, jittered delays of backoff, 2 * backoff... seconds """
+    def call(*args):
+        for attempt in range(attempts):
+            try:
+                return function(*args)
+            except Exception:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+    return call
+
+def fetch_all(jobs, fetch, concurrency, window=None):
+    """ Run fetch(*job) for each of the jobs on a pool of threads, yielding (job, result, error) in the order they finish.
+        At most window jobs (2 * concurrency by default) are submitted at a time, and each result is let go of once it's
+        yielded, so that memory doesn't grow with the number of jobs. """
+    window = window or 2 * concurrency
+    jobs = iter(jobs)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = { }
+        def submit():
+            for job in itertools.islice(jobs, window - len(futures)):
+                futures[executor.submit(fetch, *job)] = job
+        submit()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                yield job, result, error
+            submit()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Download sources for the daily price history of a ticker, in yfinance's history() format
+
+import io, os, urllib.error, urllib.parse, urllib.request
+import pandas as pd
+
+class YahooSource:
+    """ Yahoo Finance, through yfinance """
+    def history(self, ticker, start=None):
+        """ Unadjusted daily bars from start (a date), or the whole history if start is None """
+        import yfinance as yf # only needed when this source is used
+        yf_ticker = yf.Ticker(ticker)
+        if start is None:
+            return yf_ticker.history(period="max", auto_adjust=False)
+        return yf_ticker.history(start=start.strftime('%Y-%m-%d'), auto_adjust=False)
+
+class DirectorySource:
+    """ CSV files named <ticker>.csv in a local directory, with the columns of a yfinance history. Stands in for Yahoo in tests. """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def history(self, ticker, start=None):
+        path = f'{self.directory}/{ticker}.csv'
+        if not os.path.isfile(path):
+            return pd.DataFrame()
+        data = pd.read_csv(path, index_col=0, parse_dates=True)
+        return data if start is None else data[data.index >= pd.Timestamp(start)]
+
+class HTTPSource:
+    """ CSV files with the columns of a yfinance history, served at <base url>/<ticker>.csv?start=<date>, e.g. by a local stub server """
+    def __init__(self, base_url, timeout=30):
+        self.base_url, self.timeout = base_url.rstrip('/'), timeout
+
+    def history(self, ticker, start=None):
+        url = f"{self.base_url}/{urllib.parse.quote(ticker)}.csv"
+        if start is not None:
+            url += '?start=' + start.strftime('%Y-%m-%d')
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return pd.DataFrame()
+            raise
+        return pd.read_csv(io.BytesIO(body), index_col=0, parse_dates=True)
+
+SOURCES = { 'yahoo': YahooSource, 'dir': DirectorySource }
+
+def source(spec):
+    """ Source from a command line spec: 'yahoo', 'dir:<path>', or an http(s):// base url """
+    if spec.startswith(('http://', 'https://')):
+        return HTTPSource(spec)
+    name, _, argument = spec.partition(':')
+    if name not in SOURCES:
+        raise ValueError(f'unknown source {name}, expected one of: {", ".join(SOURCES)}')
+    return SOURCES[name](argument) if argument else SOURCES[name]()
@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 import os, sys, pyodbc, argparse
 import pandas as pd
-import yfinance as yf
-from math import isnan
+from datetime import timedelta
+from sources import source
+from fetcher import TokenBucket, Throttled, with_retries, fetch_all
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-m', '--markets', default='', help='Comma-separated list of markets. Default : AU')
 parser.add_argument('-v', '--verbose', default=False, help='Enable verbose mode. Default: False', action='store_true')
+parser.add_argument('-i', '--incremental', default=False, help='Only fetch the bars after the last stored date of each ticker, with a few days of overlap. Default: False', action='store_true')
+parser.add_argument('-s', '--source', default='yahoo', help="Download source: 'yahoo', 'dir:<path>' for CSV files in a local directory, or the base url of an HTTP server serving them. Default: yahoo")
+parser.add_argument('-c', '--concurrency', default=8, help='Number of tickers fetched at the same time. Default: 8')
+parser.add_argument('-r', '--rate', default=2, help='Maximum download requests per second, 0 for no limit. Default: 2')
+parser.add_argument('-b', '--batch-size', default=20, help='Number of tickers written to the database in each MERGE & commit. Default: 20')
 
 MARKETS = parser.parse_args().markets
 VERBOSE = parser.parse_args().verbose
+INCREMENTAL = parser.parse_args().incremental
+CONCURRENCY = int(parser.parse_args().concurrency)
+RATE = float(parser.parse_args().rate)
+BATCH_SIZE = int(parser.parse_args().batch_size)
+SOURCE = source(parser.parse_args().source)
+if RATE > 0:
+    SOURCE = Throttled(SOURCE, TokenBucket(RATE))
 
 if MARKETS == '':
     print('no markets were given, exiting.')
@@ -22,6 +35,8 @@ INDICES = [
 ]
 
 TABLE = '[stocks].[daily]'
+OVERLAP_DAYS = 7 # days before the last stored date that incremental fetches start from, to pick up revised bars
+RETRIES = 3 # attempts at fetching a ticker before it's skipped
 
 conn = pyodbc.connect('DRIVER={ODBC Driver 17 for SQL Server};'
                       'SERVER=host;'
@@ -34,26 +49,75 @@ def getCount():
     cursor.execute(f"SELECT COUNT(*) FROM {TABLE}")
     return int(cursor.fetchone()[0])
 
-def RowExists(key):
-    cursor.execute(f""" SELECT COUNT(*) FROM {TABLE}
-                        WHERE   date   = '{key[0]}'
-                            AND market = '{key[1]}'
-                            AND ticker = '{key[2]}'
-                    """)
-    return True if int(cursor.fetchone()[0]) == 1 else False
-
-def getRow(key):
-    cursor.execute(f""" SELECT * FROM {TABLE}
-                        WHERE   date   = '{key[0]}'
-                            AND market = '{key[1]}'
-                            AND ticker = '{key[2]}'
-                    """)
-    result = cursor.fetchone()
-    return [ str(result[0]).replace('-','') ] + [ str(c) for c in result[1:3] ] + [ (float(c) if c is not None else None) for c in result[3:] ]
+COLUMNS = [ 'date', 'market', 'ticker', 'open', 'high', 'low', 'close', 'volume', 'dividend', 'split' ]
+YF_COLUMNS = [ 'Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits' ] # in the order of COLUMNS[3:]
+
+# staging table with the same column types as the target, so that the comparisons in the MERGE are like for like
+cursor.execute(f"SELECT TOP 0 * INTO #stage FROM {TABLE}")
+cursor.fast_executemany = True
+
+MERGE = f"""
+        MERGE {TABLE} WITH (HOLDLOCK) AS t
+        USING #stage AS s
+            ON t.[date] = s.[date] AND t.[market] = s.[market] AND t.[ticker] = s.[ticker]
+        WHEN MATCHED AND EXISTS (   SELECT s.[open], s.[high], s.[low], s.[close], s.[volume], s.[dividend], s.[split]
+                                    EXCEPT
+                                    SELECT t.[open], t.[high], t.[low], t.[close], t.[volume], t.[dividend], t.[split] ) THEN
+            UPDATE SET  [open] = s.[open], [high] = s.[high], [low] = s.[low], [close] = s.[close],
+                        [volume] = s.[volume], [dividend] = s.[dividend], [split] = s.[split]
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({', '.join(f'[{c}]' for c in COLUMNS)})
+            VALUES ({', '.join(f's.[{c}]' for c in COLUMNS)})
+        OUTPUT $action, {', '.join(f'inserted.[{c}]' for c in COLUMNS)};
+        """ # EXCEPT compares NULLs as equal, so that unchanged bars with missing values are skipped
+
+def history_rows(data, market, ticker):
+    """ Rows of the daily table from a yfinance history, with missing values as NULLs """
+    values = data[YF_COLUMNS].astype(object).where(data[YF_COLUMNS].notnull(), None)
+    dates = [ d.strftime("%Y%m%d") for d in data.index ]
+    return [ (date, market, ticker, *row) for date, row in zip(dates, values.itertuples(index=False, name=None)) ]
+
+def upsert(rows):
+    """ Stage the rows in bulk, then insert or update them into the daily table with one MERGE. Returns the (inserted, updated, skipped) counts """
+    # MERGE fails if more than one staged row matches a row of the table, e.g. a bar that a ticker's refetch repeats, so only the last one is kept
+    rows = list({ row[:3]: row for row in rows }.values())
+    cursor.execute("TRUNCATE TABLE #stage")
+    cursor.executemany(f"INSERT INTO #stage({', '.join(f'[{c}]' for c in COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    cursor.execute(MERGE)
+    actions = cursor.fetchall()
+    if VERBOSE:
+        for a in actions:
+            print(a[0], list(a[1:]), sep='\t')
+    inserted = sum(1 for a in actions if a[0] == 'INSERT')
+    updated = len(actions) - inserted
+    return inserted, updated, len(rows) - inserted - updated
+
+def last_dates(markets):
+    """ The last stored date of each (market, ticker) in the given markets """
+    cursor.execute(f"SELECT market, ticker, MAX(date) FROM {TABLE} WHERE market IN ({', '.join('?' * len(markets))}) GROUP BY market, ticker", *markets)
+    return { (r[0], r[1]): pd.Timestamp(r[2]) for r in cursor.fetchall() }
+
+def fetch(ticker, last_date=None):
+    """ Daily history of the ticker. Incrementally from just before last_date if given, unless a split or a dividend
+        turned up since, which changes the split-adjusted prices of the earlier bars: then the whole history is fetched. """
+    if last_date is None:
+        return SOURCE.history(ticker)
+    data = SOURCE.history(ticker, start=last_date - timedelta(days=OVERLAP_DAYS))
+    if len(data) == 0:
+        return data
+    dates = data.index.tz_localize(None) if data.index.tz is not None else data.index # exchange-local dates, as stored
+    new = data[dates > last_date]
+    if ((new['Dividends'].fillna(0) != 0) | (new['Stock Splits'].fillna(0) != 0)).any():
+        if VERBOSE:
+            print('split or dividend since', last_date.date(), 'for', ticker, '- fetching the whole history')
+        return SOURCE.history(ticker)
+    return data
 
 initial_count = getCount() # initial row count before the inserts
+stored = last_dates([ i['market'] for i in INDICES if i['market'] in MARKETS ]) if INCREMENTAL else { }
 num_inserted, num_updated, num_skipped = 0, 0, 0
 
+jobs = []
 for i in INDICES:
     if i['market'] not in MARKETS:
         continue
@@ -61,56 +125,36 @@ for i in INDICES:
     constituents = pd.read_csv(i['file'], skiprows=i['skiprows'], header=0, usecols=[0]).iloc[:, 0].tolist()
     tickers = [ i['index_ticker'] ] + [ t + i['ticker_suffix'] for t in constituents ]
     print('Will fetch', len(tickers), 'tickers for', i['index_ticker'])
-
-    for ticker in tickers:
-        if VERBOSE:
-            print('----------', 'fetching', ticker, '----------')
-
-        yf_ticker = yf.Ticker(ticker)
-        data = yf_ticker.history(period="max", auto_adjust=False).reset_index()
-
-        for day_data in data.iterrows():
-            columns = [ None if type(c) == float and isnan(c) else c for c in day_data[1].values ]
-
-            new_values = [
-                columns[0].strftime("%Y%m%d"), # date
-                i['market'],
-                ticker,
-                columns[1], # open
-                columns[2], # high
-                columns[3], # low
-                columns[4], # close
-                # columns[5], # adj close
-                columns[6], # volume
-                columns[7], # dividends
-                columns[8] # splits
-            ]
-
-            if RowExists(new_values[:3]):
-                old_values = getRow(new_values[:3])
-                if (new_values == old_values):
-                    if VERBOSE:
-                        print('SKIP', new_values, sep='\t')
-                    num_skipped += 1
-                else:
-                    if VERBOSE:
-                        print('UPDATE', new_values, sep='\t')
-                        print('   old:', old_values)
-
-                    query =f""" UPDATE {TABLE} SET [open] = ?, [high] = ?, [low] = ?, [close] = ?, [volume] = ?, [dividend] = ?, [split] = ?
-                                WHERE   [date]   = ? AND [market] = ? AND [ticker] = ? """
-                    cursor.execute(query, *new_values[3:], *new_values[:3])
-                    num_updated += 1
-            else:
-                if VERBOSE:
-                    print('INSERT', new_values, sep='\t')
-
-                query =f""" INSERT INTO {TABLE}([date], [market], [ticker], [open], [high], [low], [close], [volume], [dividend], [split])
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) """
-                cursor.execute(query, *new_values)
-                num_inserted += 1
-
-        conn.commit()
-
+    jobs.extend((i['market'], ticker) for ticker in tickers)
+
+def write(rows):
+    """ The single writer: all the rows of a batch of tickers go in with one MERGE and one commit """
+    global num_inserted, num_updated, num_skipped
+    if len(rows) == 0:
+        return
+    inserted, updated, skipped = upsert(rows)
+    num_inserted, num_updated, num_skipped = num_inserted + inserted, num_updated + updated, num_skipped + skipped
+    conn.commit()
+
+# tickers are fetched concurrently, and written from this thread only, as they come
+fetch_ticker = with_retries(lambda market, ticker: fetch(ticker, stored.get((market, ticker))), RETRIES)
+rows, batch, failed = [], 0, []
+for (market, ticker), data, error in fetch_all(jobs, fetch_ticker, CONCURRENCY):
+    if error is not None:
+        print('failed to fetch', ticker, '-', error)
+        failed.append(ticker)
+        continue
+    if VERBOSE:
+        print('----------', 'fetched', ticker, len(data), 'rows ----------')
+    if len(data) > 0:
+        rows.extend(history_rows(data, market, ticker))
+        batch += 1
+    if batch >= BATCH_SIZE:
+        write(rows)
+        rows, batch = [], 0
+write(rows)
+
+if failed:
+    print('yf2db.py: failed to fetch', len(failed), 'tickers:', ', '.join(failed))
 print('yf2db.py:', num_inserted, 'rows inserted,', num_updated, 'rows updated,', num_skipped, 'skipped.')
 assert (getCount() - initial_count) == num_inserted
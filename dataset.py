@@ -4,55 +4,157 @@
 import numpy as np
 import pandas as pd
 import talib as ta
-from talib import abstract
-import multiprocessing, os, logging
-from lib.db import db_connection
+import multiprocessing, os, signal, sys, threading
+from time import perf_counter
+import lib.storage as storage
 import lib.tickers as ticker_lists
 import lib.intraday as iday
-from lib.suppress_stdout_stderr import suppress_stdout_stderr
-import pyodbc
-from fbprophet import Prophet
+import lib.resample as resampling
+import lib.profiling as profiling
+from lib.feature_cache import FeatureCache
+from lib.indicators import TALib
+from lib.lags import Lags
+from lib.market import MarketFeatures
+from lib.forecast import FORECASTERS
+from lib.shared import DateSlots, SharedFrame
 from datetime import datetime
 
-logging.getLogger('fbprophet').setLevel(logging.WARNING)
-
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
-TABLE = '[stox].[stocks].[daily]'
+FEATURE_VERSION = 3 # bump whenever feature generation changes, to invalidate cached features
 
 HIGH_OUTLIER = 890 # percentage
 LOW_OUTLIER = -89 # percentage
 
+LAG_COLUMNS = [ 'f_spc', 'f_ipc', 'f_spc_minus_ipc', 'f_volume' ] # features whose past values are used as lookback features
+
+INTEGER_FEATURES = ( 'CDL', 'HT_TRENDMODE' ) # TA-Lib outputs that only take a few integer values (-100/0/100, 0/1)
+INT16_FEATURES = ( 'CDLHIKKAKE', ) # CDLHIKKAKE and CDLHIKKAKEMOD also output +/-200
+
+def column_dtypes(columns, compact):
+    """ Storage dtypes of the numeric columns of a ticker's frame. Features are float64, or when compact: float32,
+        and int8 / int16 for the integer-valued TA outputs. Everything else (prices, the target) is float64. """
+    dtypes = { }
+    for c in columns:
+        if c in ('ticker', 'market'):
+            continue
+        name = c[len('f_i_'):] if c.startswith('f_i_') else c[len('f_'):]
+        if c == 'lag_row':
+            dtypes[c] = 'int64'
+        elif not (compact and c.startswith('f_')):
+            dtypes[c] = 'float64'
+        elif name.startswith(INT16_FEATURES):
+            dtypes[c] = 'int16'
+        else:
+            dtypes[c] = 'int8' if name.startswith(INTEGER_FEATURES) else 'float32'
+    return dtypes
+
+def compact_dtypes(frame):
+    return frame.astype({ c: t for c, t in column_dtypes(frame.columns, compact=True).items() if c.startswith('f_') })
+
+def model_input(frame, lags, market_features, dtype=None):
+    """ Model input for the samples in frame: their own 'f_' columns, then the features of their market, then the past values.
+        They're written into one C-contiguous matrix, float32 for compact datasets, which LightGBM and scikit-learn use as is, without copying it. """
+    dtype = dtype or lags.base.dtype
+    own = [ c for c in frame.columns if c.startswith('f_') ]
+    columns = own + list(market_features.columns) + lags.names
+    X = np.empty((len(frame), len(columns)), dtype=dtype)
+    for j, c in enumerate(own):
+        X[:, j] = frame[c].values
+    market_end = len(own) + len(market_features.columns)
+    market_features.features(frame, out=X[:, len(own):market_end])
+    lags.features(frame, out=X[:, market_end:])
+    return pd.DataFrame(X, index=frame.index, columns=columns, copy=False)
+
+TICKER_TIMEOUT = 900 # seconds that generating the features of a single ticker may take
+TICKER_ATTEMPTS = 2 # times a ticker is tried before it's skipped
+PROGRESS_INTERVAL = 0.1 # seconds between updates of the progress line on a terminal
+PROGRESS_LOG_INTERVAL = 30 # seconds between progress lines when the output goes to a file, e.g. the log of a nightly run
+
+class TickerTimeout(Exception):
+    pass
+
+def _timeout(signum, frame):
+    raise TickerTimeout('timed out')
+
+_building = None # the DataSet being built, which forked workers inherit instead of having it pickled over to them
+
+def _shared_ts_data(position):
+    return _building.shared_ts_data(position)
+
 class DataSet:
     """ This class encapsulates the whole dataset, with DB I/O and preprocessing functions """
-    def __init__(self, tickers, lookback, lookfwd, predicate="date >= '1960-01-01'", imputate=True, resample='no', ta=True, patterns=True, keep_predictors=False, intraday=False):
+    def __init__(self, tickers, lookback, lookfwd, predicate="date >= '1960-01-01'", split_date=None, imputate=True, resample='no', ta=True, patterns=True, keep_predictors=False, intraday=False, backend=None, feature_cache=False, forecaster='holt', compact=False, timeout=TICKER_TIMEOUT, build=True, profile=None):
         self.tickers = tickers
+        self.backend = storage.backend(backend)
         self.markets = set(t[0] for t in tickers)
         self.lookback = lookback
         self.lookfwd = lookfwd
         self.predicate = predicate
+        self.split_date = None if split_date is None else pd.Timestamp(split_date)
         self.imputate = imputate
         self.resample = resample
         self.ta = ta
         self.patterns = patterns
         self.keep_predictors = keep_predictors
+        self.forecaster = FORECASTERS[forecaster]
+        self.compact = compact
+        self.timeout = timeout
+        self.dtype = 'float32' if compact else 'float64'
+        self.feature_cache = FeatureCache(FEATURE_VERSION, lookback, lookfwd, resample, patterns) if feature_cache else None
         self.intraday = keep_predictors and intraday
+        self.lags = Lags(LAG_COLUMNS, lookback, self.dtype)
+        self.profile = profile # a lib.profiling.Profile to time the stages in, or None
+        if not build: # only configured, for featurizing elsewhere, e.g. by the intraday engine
+            return
         if self.intraday:
             self.intraday_data = iday.parse()
             self.today = datetime.now().date()
 
-        self.d_index, self.index_features = { }, { }
+        with profiling.stage(self.profile, 'read'):
+            raw_data = self.fetch_data()
+
+        # market features are kept out of self until the tickers are done, as self gets pickled over to the workers
+        market_features = MarketFeatures(self.dtype)
+        self.d_index, self.index_complete = { }, { }
         for i in ticker_lists.indices():
             market = i[0]
             if market in self.markets:
-                self.d_index[market] = self.ts_data(i, market_index=True)
-                self.index_features[market] = self.generate_ta_features(self.d_index[market], 'i_')
+                self.d_index[market] = self.ts_data(i, raw_data.pop(i, None), market_index=True)
+                with profiling.stage(self.profile, 'ta_features', '_'.join(i)):
+                    market_features.add(market, self.ta_features(self.d_index[market], i, 'i_'))
+                self.index_complete[market] = market_features.complete(market)
+
+        with profiling.stage(self.profile, 'featurize'): # wall time of the tickers' stages, done in parallel
+            self.multi_ts_data(raw_data)
+        self.market_features = market_features
+
+        # featurize once over the full history, then split by date. data is sorted by date first, so both halves are slices.
+        if self.split_date is not None:
+            split = self.data.index.get_level_values('date').searchsorted(self.split_date)
+            self.train, self.test = self.data.iloc[:split], self.data.iloc[split:]
+
+    def preprocess_ts(self, d, key=None):
+        """ Preprocess time series data. Weekly and monthly bars are aggregated straight from the daily ones. key names the ticker in the profile. """
+        with profiling.stage(self.profile, 'preprocess', key):
+            if resampling.offset(self.resample) is not None:
+                d = resampling.aggregate(self.clean_bars(d), self.resample)
+            else:
+                d = self.resample_bars(self.daily_bars(d))
+        return self.derive(d, key)
 
-        self.multi_ts_data()
+    def daily_bars(self, d):
+        """ Daily bars of the last segment of a ticker's history, imputed, and padded over the days without a bar """
+        d = self.clean_bars(d)
 
-    def preprocess_ts(self, d):
-        """ Preprocess time series data """
-        d.index = pd.to_datetime(d.index)
+        # pad (forward fill) for weekend days so that resampling to longer periods don't result in gaps
+        d = d.resample('D').ffill()
+        d.loc[d.index.weekday > 4, 'volume'] = 0
+        return d
+
+    def clean_bars(self, d):
+        """ The last segment of a ticker's history, imputed """
+        d.index = pd.to_datetime(d.index).as_unit('ns') # whichever backend, or the intraday data, the bars came from
 
         # gap detection
         dates = d.index.to_series()
@@ -62,23 +164,27 @@ class DataSet:
             last_segment_start = gaps.index[-1]
             d = d.loc[d.index >= last_segment_start]
 
-        # imputation
+        # imputation, on the arrays of the columns. Missing values are NaN or zero, except for NaN opens, highs & lows, which are left as they are.
         if self.imputate:
-            d.close.replace(to_replace=[0, np.nan, None], method='ffill', inplace=True)
-            d.open[d.open == 0 | d.open.isnull()] = d.close.shift(1) # fill in missing open from previous close
-            # d.open[d.open == 0] = d.close # for values that the above didn't work, fill in from close. Didn't change score with current data
+            d = d.copy()
+            close = d['close'].values.astype('float64')
+            valid = ~((close == 0) | np.isnan(close))
+            last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(close)), -1))
+            close = np.where(valid | (last_valid < 0), close, close[np.maximum(last_valid, 0)]) # forward fill
+            open_ = d['open'].values.astype('float64')
+            open_ = np.where(open_ == 0, np.concatenate([ [ np.nan ], close ])[:-1], open_) # fill in missing open from previous close
+            # open_ = np.where(open_ == 0, close, open_) # for values that the above didn't work, fill in from close. Didn't change score with current data
+            d['close'], d['open'] = close, open_
             if 'high' in d.columns:
-                d.high[(d.high == 0 | d.high.isnull()) & (d.close > d.open)] = d.close
-                d.high[(d.high == 0 | d.high.isnull()) & (d.close <= d.open)] = d.open
+                high = d['high'].values.astype('float64')
+                d['high'] = np.where(high == 0, np.where(close > open_, close, np.where(close <= open_, open_, high)), high)
             if 'low' in d.columns:
-                d.low[(d.low == 0 | d.low.isnull()) & (d.close > d.open)] = d.open
-                d.low[(d.low == 0 | d.low.isnull()) & (d.close <= d.open)] = d.close
-
-        # pad (forward fill) for weekend days so that resampling to longer periods don't result in gaps
-        d = d.resample('D').pad()
-        d.at[d.index.weekday > 4, 'volume'] = 0
+                low = d['low'].values.astype('float64')
+                d['low'] = np.where(low == 0, np.where(close > open_, open_, np.where(close <= open_, close, low)), low)
+        return d
 
-        # resample
+    def resample_bars(self, d):
+        """ Daily bars resampled to the resampling window. A bar is only kept if its label falls on one of the days. """
         if self.resample != 'no':
             for c in d.columns:
                 if c == 'open':
@@ -92,7 +198,10 @@ class DataSet:
                 elif c == 'volume':
                     d[c] = d[c].resample(self.resample).sum()
             d.dropna(inplace=True)
+        return d
 
+    def derive(self, d, key=None):
+        """ Nominal price, deltas and the price forecast of the resampled bars. None if there are too few of them. """
         # No column except 'volume' can have a zero value
         # assert 0 not in (d.iloc[:,:-1]).values
 
@@ -105,72 +214,88 @@ class DataSet:
         if len(d.dropna()) <= self.lookback:
             return
 
-        # fbprophet predictions as a feature
-        dp = pd.concat([d.index.to_series(), d.close], axis=1)
-        dp.columns = ['ds', 'y']
-        with suppress_stdout_stderr():
-            m = Prophet(seasonality_mode='multiplicative').fit(dp)
-        ftr = m.make_future_dataframe(periods=self.lookfwd, freq=self.resample)
-        forecast = (m.predict(ftr).shift(-self.lookfwd))[['ds', 'yhat']]
-        forecast.columns = ['date', 'forecast']
-        forecast.set_index('date', inplace=True)
-        d = pd.concat([d, forecast], axis=1)
-        d['forecast'] = d['forecast'] / d['close']
+        # price forecast as a feature
+        with profiling.stage(self.profile, 'forecast', key):
+            d['forecast'] = self.forecaster(d, self.lookfwd, self.resample) / d['close']
         d.dropna(inplace=True)
 
         return d
 
-    def generate_ta_features(self, data, prefix=''):
-        prefix = 'f_' + prefix
+    def relative_volume(self, volume, price):
+        """ Volume and price relative to their means up to each bar, so that no bar's value depends on later bars """
+        return (volume / volume.expanding().mean()) * (price / price.expanding().mean())
+
+    def ribbon_features(self, panel, price, prefix='f_'):
+        """ 'Rolling window ribbon' indicators for each period up to self.lookback, as (array, name) tuples:
+            over a (time x tickers) Indicators panel with price the (time x tickers) nominal price,
+            or over a single ticker's TALib with price its nominal price series """
         features = []
         for i in range(2, (self.lookback + 1)):
             features.extend([
-                (abstract.Function('AROONOSC')(data, timeperiod=i), f'{prefix}AROONOSC_{i}'),
-                (abstract.Function('ATR')(data, timeperiod=i) / data['price'], f'{prefix}ATR_{i}'),
-                (abstract.Function('CORREL')(data, timeperiod=i), f'{prefix}CORREL_{i}'),
-                (abstract.Function('BETA')(data, timeperiod=i), f'{prefix}BETA_{i}'),
-                (abstract.Function('CMO')(data, timeperiod=i), f'{prefix}CMO_{i}'),
-                (abstract.Function('CCI')(data, timeperiod=i), f'{prefix}CCI_{i}')
+                (panel.AROONOSC(i), f'{prefix}AROONOSC_{i}'),
+                (panel.ATR(i) / price, f'{prefix}ATR_{i}'),
+                (panel.CORREL(i), f'{prefix}CORREL_{i}'),
+                (panel.BETA(i), f'{prefix}BETA_{i}'),
+                (panel.CMO(i), f'{prefix}CMO_{i}'),
+                (panel.CCI(i), f'{prefix}CCI_{i}')
             ])
 
-            for c in ['close', 'volume']:
-                features.append((abstract.Function('LINEARREG_SLOPE')(data, price=c, timeperiod=i), f'{prefix}LINEARREG_SLOPE_{c}_{i}'))
+            for col in ['close', 'volume']:
+                features.append((panel.LINEARREG_SLOPE(getattr(panel, col), i), f'{prefix}LINEARREG_SLOPE_{col}_{i}'))
 
             if i >= 6: # these indicators don't work well with very small period sizes
+                slowk, slowd = panel.STOCH(i, int(round(i * 3 / 5)), int(round(i * 3 / 5)))
                 features.extend([
-                    (abstract.Function('STOCHF')(data, fastk_period=i, fastd_period=int(round(i * 3 / 5)))['fastk'], f'{prefix}STOCHF_K_{i}'),
-                    (abstract.Function('STOCH')(data, fastk_period=i, slowk_period=int(round(i * 3 / 5)), slowd_period=int(round(i * 3 / 5)))['slowd'], f'{prefix}STOCH_D_{i}'),
-                    (abstract.Function('STOCH')(data, fastk_period=i, slowk_period=int(round(i * 3 / 5)), slowd_period=int(round(i * 3 / 5)))['slowk'], f'{prefix}STOCH_K_{i}'),
-                    (abstract.Function('ULTOSC')(data, timeperiod1=int(round(i / 3)), timeperiod2=int(round(i / 2)), timeperiod3=i), f'{prefix}ULTOSC_{i}'),
-                    (abstract.Function('ADOSC')(data, fastperiod=int(round(i * 3 / 10)), slowperiod=i), f'{prefix}ADOSC_{i}')
+                    (panel.STOCHF_K(i, int(round(i * 3 / 5))), f'{prefix}STOCHF_K_{i}'),
+                    (slowd, f'{prefix}STOCH_D_{i}'),
+                    (slowk, f'{prefix}STOCH_K_{i}'),
+                    (panel.ULTOSC(int(round(i / 3)), int(round(i / 2)), i), f'{prefix}ULTOSC_{i}'),
+                    (panel.ADOSC(int(round(i * 3 / 10)), i), f'{prefix}ADOSC_{i}')
                 ])
+        return features
 
-        features.extend([
-            (abstract.Function('HT_TRENDMODE')(data), f'{prefix}HT_TRENDMODE'), # other HT_ functions cause extra drops
-            (abstract.Function('MFI')(data), f'{prefix}MFI'),
-            (abstract.Function('BOP')(data), f'{prefix}BOP')
-        ])
+    def talib_features(self, o, h, l, c, v, prefix='f_'):
+        """ TA-Lib indicators and chart patterns of a single ticker's float64 arrays, as (array, name) tuples """
+        features = [
+            (ta.HT_TRENDMODE(c), f'{prefix}HT_TRENDMODE'), # other HT_ functions cause extra drops
+            (ta.MFI(h, l, c, v), f'{prefix}MFI'),
+            (ta.BOP(o, h, l, c), f'{prefix}BOP')
+        ]
 
         if self.patterns:
             for pattern in ta.get_function_groups()['Pattern Recognition']:
-                features.append((abstract.Function(pattern)(data), prefix + pattern))
-
+                features.append((getattr(ta, pattern)(o, h, l, c), prefix + pattern))
         return features
 
-    def ts_data(self, ticker, market_index=False): # price changes of both the security and the market
-        """ Fetch time series data for the requested ticker and generate features """
-        dbconn = db_connection()
-        query = f"""
-                SELECT * FROM {TABLE} 
-                WHERE {self.predicate}
-                    AND market = '{ticker[0]}' 
-                    AND ticker = '{ticker[1]}' 
-                ORDER BY date ASC
-                """
-        data = pd.read_sql_query(   query,
-                                    dbconn,
-                                    index_col=['date'])
-        dbconn.close()
+    def generate_ta_features(self, data, prefix=''):
+        prefix = 'f_' + prefix
+        o, h, l, c, v = ( data[col].values.astype('float64') for col in ['open', 'high', 'low', 'close', 'volume'] )
+        series = lambda values, name: (pd.Series(values, index=data.index), name)
+        features = self.ribbon_features(TALib(o, h, l, c, v), data['price'].values, prefix) + self.talib_features(o, h, l, c, v, prefix)
+        return [ series(*f) for f in features ]
+
+    def ta_features(self, data, ticker, prefix=''):
+        """ TA features for the ticker, served from the feature cache when it's enabled """
+        if self.feature_cache is None:
+            return self.generate_ta_features(data, prefix)
+
+        def generate(d):
+            features = self.generate_ta_features(d, prefix)
+            frame = pd.concat([f[0] for f in features], axis=1)
+            frame.columns = [f[1] for f in features]
+            return frame
+
+        frame = self.feature_cache.features(prefix + '_'.join(ticker), data, generate)
+        return [ (frame[c], c) for c in frame.columns ]
+
+    def fetch_data(self):
+        """ Fetch the data for all requested markets in one streamed read, partitioned by (market, ticker) """
+        return storage.partition(self.backend.read_daily(self.markets, self.predicate))
+
+    def ts_data(self, ticker, data, market_index=False): # price changes of both the security and the market
+        """ Generate features for the requested ticker from its slice of the bulk-fetched data """
+        if data is None:
+            data = pd.DataFrame(columns=storage.COLUMNS[1:], index=pd.DatetimeIndex([], name='date'))
 
         if self.intraday:
             try:
@@ -181,13 +306,14 @@ class DataSet:
                 intraday_data_sample.reset_index(level=[1, 2], inplace=True)
                 data = pd.concat([data, intraday_data_sample])
 
-        d_ticker = self.preprocess_ts(data)
+        key = '_'.join(ticker)
+        d_ticker = self.preprocess_ts(data, key)
 
         if market_index:
             return d_ticker
 
         if d_ticker is None:
-            return pd.DataFrame()
+            return pd.DataFrame(), self.lags.base[:0]
 
         # Feature generation
         features = [
@@ -199,7 +325,7 @@ class DataSet:
             (d_ticker['pc'], 'f_spc'),
             (d_ticker['open'], 'open'),
             (d_ticker['close'], 'close'),
-            ((d_ticker['volume'] / d_ticker['volume'].mean()) * (d_ticker['price'] / d_ticker['price'].mean()), 'f_volume'),
+            (self.relative_volume(d_ticker['volume'], d_ticker['price']), 'f_volume'),
             (d_ticker['forecast'], 'f_forecast'),
 
             (self.d_index[ticker[0]]['pc'], 'f_ipc'),
@@ -210,6 +336,8 @@ class DataSet:
 
         d_ticker['ticker'] = '_'.join([ticker[0], ticker[1]]) # will be used as index
         features.append((d_ticker['ticker'], 'ticker'))
+        d_ticker['market'] = ticker[0] # key to the market features
+        features.append((d_ticker['market'], 'market'))
 
         # d_ticker['sector'] = sectors.index(companies.loc[ticker]['GICS industry group'])
         # features.append((d_ticker['sector'], 'sector'))
@@ -218,24 +346,29 @@ class DataSet:
         # features.append((d_ticker['week'], 'week'))
 
         if self.ta: # most of these are 'rolling window ribbon', i.e. multiple features for a range of periods up to self.lookback
-            features.extend(self.generate_ta_features(d_ticker))
+            with profiling.stage(self.profile, 'ta_features', key):
+                features.extend(self.ta_features(d_ticker, ticker))
 
-        d = pd.concat([d[0] for d in (features + self.index_features[ticker[0]])], axis=1, sort=False)
-        d.columns = [d[1] for d in (features + self.index_features[ticker[0]])]
+        with profiling.stage(self.profile, 'concat', key):
+            d = pd.concat([d[0] for d in features], axis=1, sort=False)
+            d.columns = [d[1] for d in features]
 
         # Filter out outliers
         d.f_spc.drop(d.f_spc[d.f_spc > HIGH_OUTLIER].index, inplace=True)
         d.f_spc.drop(d.f_spc[d.f_spc < LOW_OUTLIER].index, inplace=True)
 
-        # past values in a rolling window
-        for c in ['f_spc', 'f_ipc', 'f_spc_minus_ipc', 'f_volume']:
-            for i in range(2, (self.lookback + 1)):
-                d = pd.concat([d, d[c].shift(i).rename(f'f_past_{c[2:]}_{i}')], axis=1)
+        # past values in a rolling window, kept in a base array and only expanded into features for the model input
+        with profiling.stage(self.profile, 'lags', key):
+            base, d['lag_row'] = self.lags.ticker_base(d)
+            lags_complete = self.lags.complete(base, d['lag_row'].values)
 
         predictor = d[d.f_spc.notnull()].tail(1).copy()
 
         # calculate and insert the target variable column
         future = (d['price'].shift(self.lookfwd * -1) / d['price'] - 1) * 100
+        if self.split_date is not None: # training samples can't have targets from the test period
+            future_dates = d.index.to_series().shift(self.lookfwd * -1)
+            future[(d.index < self.split_date) & (future_dates >= self.split_date).values] = np.nan
 
         d = pd.concat([d, future.rename('future')], axis=1)
 
@@ -245,20 +378,148 @@ class DataSet:
 
         d.f_volume[d.f_volume == 0] = np.nan # Get rid of zero-volume samples
         # d.future[d.future == 0] = np.nan # Also where the target is zero
-        d.dropna(inplace=True)
-        if self.keep_predictors:
+        d = d[d.notnull().all(axis=1).values & lags_complete & d.index.isin(self.index_complete[ticker[0]])]
+        if self.keep_predictors and (self.split_date is None or (predictor.index >= self.split_date).all()):
             d = pd.concat([d, predictor], axis=0, sort=False)
 
-        return d
-
-    def multi_ts_data(self):
-        """ Multiprocessing wrapper for quickly reading data for multiple tickers """
-        pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        ds = pd.concat(pool.map(self.ts_data, self.tickers), sort=False)
-        pool.close()
-        pool.join()
+        if self.compact:
+            d = compact_dtypes(d)
 
-        ds.set_index('ticker', append=True, inplace=True)
-        ds.sort_index(inplace=True)
+        return d, base
 
-        self.data = ds
+    def guarded_ts_data(self, position):
+        """ ts_data for a ticker, retried on failure or timeout. Returns the frame and the lag base array, or the error """
+        ticker = self.sorted_tickers[position]
+        alarm = self.timeout and threading.current_thread() is threading.main_thread() # signals can only be handled there
+        for attempt in range(TICKER_ATTEMPTS):
+            if alarm:
+                signal.signal(signal.SIGALRM, _timeout)
+                signal.alarm(self.timeout)
+            try:
+                d, base = self.ts_data(ticker, self.raw_data.get(ticker))
+                return d, base, None
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            finally:
+                if alarm:
+                    signal.alarm(0)
+        return pd.DataFrame(), self.lags.base[:0], error
+
+    def write_shared(self, position, d, base, error=None):
+        """ Write the frame of a ticker into the shared frame. Returns the number of rows, the frame itself if it doesn't fit
+            the shared layout (e.g. with a resampling rule whose labels aren't on the grid), the ticker's lag base array and its error """
+        if len(d) == 0:
+            return position, 0, None, base, error
+        rows = self.slots.rows(position, d.index)
+        if rows is None or list(d.columns) != self.columns:
+            return position, len(d), d, base, error
+        self.shared.write(rows, d)
+        return position, len(d), None, base, error
+
+    def shared_ts_data(self, position):
+        """ In a pool worker: write_shared's results, and the ticker's profile records for the parent """
+        if self.profile is None:
+            return self.write_shared(position, *self.guarded_ts_data(position)) + (None,)
+        self.profile.worker()
+        mark = len(self.profile.records)
+        return self.write_shared(position, *self.guarded_ts_data(position)) + (self.profile.since(mark),)
+
+    def collect(self, result, done, time_start):
+        """ Note down a finished ticker: log it if it failed, keep its profile records, and show the progress so far,
+            updated in place on a terminal, or as a line every PROGRESS_LOG_INTERVAL seconds otherwise """
+        position, _, _, _, error, records = result
+        if records:
+            self.profile.records.extend(records)
+        terminal = sys.stdout.isatty()
+        if error is not None:
+            self.failed['_'.join(self.sorted_tickers[position])] = error
+            print('\n' if terminal else '', 'failed: ', '_'.join(self.sorted_tickers[position]), ' - ', error, sep='', flush=True)
+        now = perf_counter()
+        if done < len(self.sorted_tickers) and now - self.progress_shown < (PROGRESS_INTERVAL if terminal else PROGRESS_LOG_INTERVAL):
+            return
+        self.progress_shown = now
+        elapsed = now - time_start
+        progress = f'tickers: {done}/{len(self.sorted_tickers)}, {done / elapsed if elapsed > 0 else 0:.1f}/s, failed: {len(self.failed)}'
+        print('\r' + progress if terminal else progress, end='' if terminal else '\n', flush=True)
+
+    def multi_ts_data(self, raw_data):
+        """ Multiprocessing wrapper for generating features for multiple tickers. Workers are forked, so they see the DataSet
+            and the raw data without anything being pickled, and they write their rows straight into a shared frame that is
+            laid out in (date, ticker) order. Only the number of rows and the lag base array of each ticker are sent back.
+            Tickers are streamed through the pool longest history first, so that the slowest ones don't hold up the end of the run.
+            A ticker that fails or times out is retried, then skipped, and recorded in self.failed. """
+        global _building
+        self.raw_data = raw_data
+        self.sorted_tickers = sorted(self.tickers, key='_'.join) # the order of the tickers within each date
+        self.failed = { }
+        schedule = sorted(range(len(self.sorted_tickers)), key=lambda p: -len(raw_data.get(self.sorted_tickers[p], ())))
+        time_start = perf_counter()
+        self.progress_shown = float('-inf')
+        spans = { }
+        for position, ticker in enumerate(self.sorted_tickers):
+            if raw_data.get(ticker) is not None and len(raw_data[ticker]) > 0:
+                dates = pd.to_datetime(raw_data[ticker].index)
+                spans[position] = (dates.min(), max(dates.max(), pd.Timestamp(self.today)) if self.intraday else dates.max())
+
+        # tickers are done here until one has any rows, to find out the columns of the shared frame
+        results, d = [], pd.DataFrame()
+        for done, position in enumerate(schedule, 1):
+            d, base, error = self.guarded_ts_data(position)
+            if len(d) > 0:
+                break
+            results.append((position, 0, None, base, error, None))
+            self.collect(results[-1], done, time_start)
+
+        ds = None
+        if len(d) > 0:
+            self.columns, date_dtype = list(d.columns), d.index.dtype
+            self.slots = DateSlots(spans, 'D' if self.resample == 'no' else self.resample)
+            self.shared = SharedFrame(column_dtypes(self.columns, self.compact), self.slots.size)
+            results.append(self.write_shared(position, d, base, error) + (None,))
+            self.collect(results[-1], done, time_start)
+            del d
+
+            _building = self
+            pool = multiprocessing.get_context('fork').Pool(processes=multiprocessing.cpu_count())
+            for result in pool.imap_unordered(_shared_ts_data, schedule[done:]):
+                results.append(result)
+                self.collect(result, len(results), time_start)
+            pool.close()
+            pool.join()
+            _building = None
+
+            written = self.shared.compact()
+            positions = self.slots.position[written]
+            offsets = np.zeros(len(self.sorted_tickers), dtype='int64')
+            offsets[[ r[0] for r in results ]] = self.lags.extend([ r[3] for r in results ])
+            lag_row = self.shared.column('lag_row')
+            lag_row += offsets[positions]
+
+            markets = sorted(self.markets)
+            market_codes = np.array([ markets.index(t[0]) for t in self.sorted_tickers ])
+            names = [ '_'.join(t) for t in self.sorted_tickers ]
+            ticker_level = pd.CategoricalIndex(names) if self.compact else pd.Index(names)
+            index = pd.MultiIndex(levels=[self.slots.grid.astype(date_dtype), ticker_level], codes=[self.slots.bin[written], positions], names=['date', 'ticker'])
+            ds = self.shared.frame( [ c for c in self.columns if c != 'ticker' ], index,
+                                    { 'market': pd.Categorical.from_codes(market_codes[positions], categories=markets) })
+
+            # frames that didn't fit the shared layout are merged in the slow way
+            fallbacks = [ r for r in results if r[2] is not None ]
+            if fallbacks:
+                frames = [ ds ]
+                for position, _, f, _, _, _ in fallbacks:
+                    f['lag_row'] += offsets[position]
+                    f['market'] = pd.Categorical(f['market'], categories=markets)
+                    if self.compact:
+                        f['ticker'] = pd.Categorical(f['ticker'], categories=names)
+                    frames.append(f.set_index('ticker', append=True))
+                ds = pd.concat(frames, sort=False).sort_index()
+            ds.index = ds.index.remove_unused_levels()
+            del self.slots, self.shared, self.columns
+
+        if sys.stdout.isatty():
+            print()
+        if self.failed:
+            print(len(self.failed), 'tickers failed:', ', '.join(self.failed))
+        del self.raw_data, self.sorted_tickers
+        self.data = ds if ds is not None else pd.DataFrame(index=pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), []], names=['date', 'ticker']))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Walk-forward (rolling origin) backtests, with the folds trained and evaluated in parallel on one shared model input
+
+import numpy as np
+import pandas as pd
+import multiprocessing
+from time import perf_counter
+from lib.evaluation import alpha, per_ticker_metrics
+
+_running = None # the Backtest being run, which forked workers inherit instead of having the model input pickled over to them
+
+def _run_fold(k):
+    return _running.run_fold(k)
+
+def folds(dates, n_folds, window=None, embargo=1):
+    """ Walk-forward folds over the sorted dates of the samples, as (train rows, test rows) slices.
+        The periods are split into n_folds + 1 consecutive blocks, and fold k tests on block k + 1.
+        It trains on all of the periods before it (expanding), or only on the last window of them (sliding),
+        leaving out the last embargo periods before the test block, whose targets overlap it. """
+    dates = np.asarray(dates)
+    if (np.diff(dates.astype('int64')) < 0).any():
+        raise ValueError('samples have to be sorted by date')
+    periods = np.unique(dates)
+    step = len(periods) // (n_folds + 1)
+    if step == 0 or step <= embargo:
+        raise ValueError(f'{len(periods)} periods are not enough for {n_folds} folds with an embargo of {embargo}')
+
+    row = lambda i: int(np.searchsorted(dates, periods[i], 'left')) if i < len(periods) else len(dates)
+    result = [ ]
+    for k in range(1, n_folds + 1):
+        test_start, test_end = k * step, len(periods) if k == n_folds else (k + 1) * step
+        train_end = test_start - embargo
+        train_start = 0 if window is None else max(train_end - window, 0)
+        result.append(( slice(row(train_start), row(train_end)), slice(row(test_start), row(test_end)) ))
+    return result
+
+class Backtest:
+    """ Trains a new model on each fold and evaluates it on the fold's test rows. The model input is built once
+        and shared with the workers through fork. Each fold sees it through slices, so no fold copies it. """
+    def __init__(self, new_model, X, y, folds):
+        """ new_model: function returning an unfitted model, X & y: model input and targets sorted by date, folds: from folds() """
+        self.new_model, self.folds = new_model, folds
+        self.X, self.y = X, y
+        self.matrix, self.targets = X.to_numpy(), y.to_numpy()
+        self.dates = X.index.get_level_values('date')
+
+    def run_fold(self, k):
+        time_start = perf_counter()
+        train, test = self.folds[k]
+        model = self.new_model()
+        if self.jobs > 1: # the folds already keep the cores busy
+            model.set_params(**{ p: 1 for p in model.get_params() if p.split('__')[-1] == 'n_jobs' })
+        model.fit(self.matrix[train], self.targets[train])
+        predictions = model.predict(self.matrix[test])
+
+        fold = {    'fold': k + 1,
+                    'train_start': self.dates[train.start], 'train_end': self.dates[train.stop - 1],
+                    'test_start': self.dates[test.start], 'test_end': self.dates[test.stop - 1],
+                    'train_samples': train.stop - train.start, 'test_samples': test.stop - test.start,
+                    'alpha': alpha(self.targets[test], predictions),
+                    'seconds': round(perf_counter() - time_start, 1) }
+        tickers = per_ticker_metrics(self.y.iloc[test], predictions)
+        tickers.insert(0, 'fold', k + 1)
+        return fold, tickers
+
+    def run(self, jobs=None, verbose=1):
+        """ Per-fold results, and per-ticker results of each fold """
+        global _running
+        self.jobs = min(jobs or multiprocessing.cpu_count(), len(self.folds))
+        if self.jobs > 1:
+            _running = self
+            pool = multiprocessing.get_context('fork').Pool(processes=self.jobs)
+            results = [ ]
+            for result in pool.imap_unordered(_run_fold, range(len(self.folds))):
+                results.append(result)
+                if verbose > 0:
+                    print(f"fold {result[0]['fold']}: alpha {result[0]['alpha']:.2f} on {result[0]['test_samples']} samples")
+            pool.close()
+            pool.join()
+            _running = None
+        else:
+            results = [ self.run_fold(k) for k in range(len(self.folds)) ]
+
+        per_fold = pd.DataFrame([ r[0] for r in results ]).sort_values('fold').set_index('fold')
+        per_ticker = pd.concat([ r[1] for r in results ]).rename_axis('ticker').reset_index().sort_values(['fold', 'ticker'])
+        return per_fold, per_ticker.set_index(['fold', 'ticker'])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Dumps of the datasets a model is trained and scored on, named by STAMP, as memory-mapped Arrow IPC files
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import json, os, subprocess
+from lib.lags import Lags
+from lib.market import MarketFeatures
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+DUMPS_DIR = BASE_DIR + '/../ds_dumps'
+PARTS = ('train', 'test', 'lags', 'market')
+FRAMES = ('train', 'test')
+METADATA_KEY = b'stox'
+
+def path(stamp, part):
+    return f'{DUMPS_DIR}/ds_{part}_{stamp}.arrow'
+
+def legacy_path(stamp, part):
+    """ Compressed joblib pickle of the train or test frame, as dumps were written before. These have no lags or market parts,
+        and their frames lack the columns model_input() needs, so they can't be loaded. """
+    return f'{DUMPS_DIR}/ds_{part}_{stamp}.bin'
+
+def code_version():
+    """ Commit the code was at, or None when not run from a git checkout """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def frame_table(frame):
+    return pa.Table.from_pandas(frame, preserve_index=True)
+
+def lags_table(lags):
+    metadata = { 'columns': list(lags.columns), 'lookback': lags.lookback, 'dtype': str(lags.base.dtype) }
+    return pa.table({ c: lags.base[:, j] for j, c in enumerate(lags.columns) }), metadata
+
+def market_table(market):
+    tables = [ t.rename_axis('date').reset_index().assign(market=m) for m, t in market.tables.items() ]
+    frame = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame({ 'date': [ ], 'market': [ ] })
+    return pa.Table.from_pandas(frame, preserve_index=False), { 'dtype': str(np.dtype(market.dtype)) }
+
+def write(table, target, metadata):
+    """ Write uncompressed, as a single record batch, so that it can be memory-mapped back without copying """
+    schema = table.schema.with_metadata({ **(table.schema.metadata or { }), METADATA_KEY: json.dumps(metadata, default=str).encode() })
+    with pa.OSFile(target + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        writer.write_table(table.replace_schema_metadata(schema.metadata), max_chunksize=max(table.num_rows, 1))
+    os.replace(target + '.tmp', target)
+
+def save(stamp, train, test, lags, market, **metadata):
+    """ Dump the parts of the stamp's dataset, with the given metadata (e.g. lookback and resampling rule) and the code version in their schema """
+    metadata = { 'stamp': stamp, 'code_version': code_version(), **metadata }
+    for part, frame in zip(FRAMES, (train, test)):
+        date = frame.index.get_level_values('date')
+        write(frame_table(frame), path(stamp, part), { **metadata, 'part': part, 'sorted_by_date': bool(date.is_monotonic_increasing) })
+    for part, (table, extra) in zip(('lags', 'market'), (lags_table(lags), market_table(market))):
+        write(table, path(stamp, part), { **metadata, **extra, 'part': part })
+
+def read_table(stamp, part):
+    """ The part's table, memory-mapped, and its metadata """
+    table = pa.ipc.open_file(pa.memory_map(path(stamp, part))).read_all()
+    return table, json.loads(table.schema.metadata[METADATA_KEY])
+
+def metadata(stamp, part='test'):
+    """ Metadata of a dumped part, read from its schema, or None if it hasn't been dumped as Arrow """
+    try:
+        return json.loads(pa.ipc.open_file(pa.memory_map(path(stamp, part))).schema.metadata[METADATA_KEY])
+    except (FileNotFoundError, KeyError, TypeError):
+        return None
+
+def select(table, metadata, columns=None, start=None, end=None):
+    """ Rows of a frame's table dated from start (inclusive) to end (exclusive), with only the given columns and the index """
+    if start is not None or end is not None:
+        dates = table.column('date').to_numpy()
+        if metadata.get('sorted_by_date'): # a zero-copy slice
+            first = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), 'left')
+            last = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), 'left')
+            table = table.slice(first, max(last - first, 0))
+        else:
+            mask = np.ones(len(dates), dtype=bool)
+            if start is not None:
+                mask &= dates >= np.datetime64(pd.Timestamp(start))
+            if end is not None:
+                mask &= dates < np.datetime64(pd.Timestamp(end))
+            table = table.filter(pa.array(mask))
+    if columns is not None:
+        index = json.loads(table.schema.metadata[b'pandas'])['index_columns']
+        table = table.select([ c for c in table.column_names if c in set(columns) or c in index ])
+    return table
+
+def load_frame(stamp, part, columns=None, start=None, end=None):
+    table, meta = read_table(stamp, part)
+    # one block per column, so that columns without nulls keep referring to the memory map instead of being copied
+    return select(table, meta, columns, start, end).to_pandas(split_blocks=True, date_as_object=False)
+
+def load_lags(stamp):
+    table, meta = read_table(stamp, 'lags')
+    lags = Lags(meta['columns'], meta['lookback'], meta['dtype'])
+    if table.num_rows > 0:
+        lags.base = np.column_stack([ table.column(c).to_numpy() for c in meta['columns'] ]).astype(meta['dtype'], copy=False)
+    return lags
+
+def load_market(stamp):
+    table, meta = read_table(stamp, 'market')
+    market = MarketFeatures(meta['dtype'])
+    frame = table.to_pandas(date_as_object=False)
+    for m, rows in frame.groupby('market', sort=False, observed=True):
+        market.tables[m] = rows.drop(columns='market').set_index('date').astype(market.dtype)
+    return market
+
+def load(stamp, parts=PARTS, columns=None, start=None, end=None):
+    """ The dumped parts of the stamp's dataset, in the order asked for. The train and test frames can be narrowed down
+        to some columns (the index is always included) and to a date range, from start up to but excluding end. """
+    if not all(os.path.isfile(path(stamp, part)) for part in parts) and any(os.path.isfile(legacy_path(stamp, part)) for part in FRAMES):
+        raise FileNotFoundError(f'the datasets of {stamp} were dumped by an earlier version as joblib pickles, which can\'t be loaded. '
+                                 'Re-dump them with -d')
+    loaded = [ ]
+    for part in parts:
+        if part in FRAMES:
+            loaded.append(load_frame(stamp, part, columns, start, end))
+        else:
+            loaded.append({ 'lags': load_lags, 'market': load_market }[part](stamp))
+    return tuple(loaded)
+
+def modified(stamp, parts=PARTS):
+    """ Time the dumps of the stamp were last written, or None if any of them is missing """
+    try:
+        return max(os.path.getmtime(path(stamp, part)) for part in parts)
+    except OSError:
+        return None
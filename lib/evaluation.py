@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Model evaluation and per-ticker scoring of predictions
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+
+def alpha(y_true, y_pred):
+    return (abs(y_true).mean() / mean_absolute_error(y_true, y_pred) - 1) * 100
+
+def per_ticker_metrics(y_test, predictions):
+    """ Volatility, MAE, explained variance, number of test samples and alpha of the predictions on the test set of each ticker,
+        in one grouped pass. The explained variance is computed as sklearn's explained_variance_score does. """
+    y = np.asarray(y_test, dtype='float64')
+    error = y - np.asarray(predictions, dtype='float64')
+    tickers = y_test.index.get_level_values('ticker').astype(str)
+    g = pd.DataFrame({ 'y': y, 'abs_y': np.abs(y), 'error': error, 'abs_error': np.abs(error) }, index=tickers).groupby(level=0, sort=True)
+    means, variances = g.mean(), g[['y', 'error']].var(ddof=0)
+
+    # sklearn gives 1 for a perfect fit on a constant target, and 0 for an imperfect one
+    constant = variances['y'] <= 0
+    var_score = 1 - variances['error'] / variances['y'].where(~constant)
+    var_score[constant] = (variances['error'][constant] <= 0).astype('float64')
+
+    metrics = pd.DataFrame({ 'volatility': means['abs_y'], 'MAE': means['abs_error'], 'var_score': var_score, 'test_samples': g.size() })
+    metrics['alpha'] = (metrics['volatility'] / metrics['MAE'] - 1) * 100
+    return metrics
+
+def score_predictors(predictors, latest, y_test, predictions, model, min_samples, verbose=1):
+    """ Predict with the model for each ticker that has an up-to-date, complete predictor row and enough test samples,
+        in one batch, and rank them by potential: the predicted change, weighted by how well the ticker's test set was predicted """
+    tickers = predictors.index.get_level_values('ticker').astype(str)
+    dates = pd.Series(predictors.index.get_level_values('date'), index=tickers)
+    up_to_date = dates.groupby(level=0, sort=True).last() == latest
+    complete = pd.Series(predictors.notnull().all(axis=1).values, index=tickers).groupby(level=0, sort=True).all()
+    trading = pd.Series(predictors['f_volume'].values, index=tickers).groupby(level=0, sort=True).last() > 0
+    eligible = up_to_date & complete & trading
+
+    metrics = per_ticker_metrics(y_test, predictions).reindex(eligible.index)
+    enough_samples = metrics['test_samples'] >= min_samples
+    if verbose > 0:
+        for t in eligible.index:
+            if not eligible[t]:
+                print('Not predicting', t)
+            elif pd.notnull(metrics.at[t, 'test_samples']) and not enough_samples[t]:
+                print('Not predicting', t, 'as it has less than', min_samples, 'samples.')
+    selected = eligible.index[eligible & enough_samples]
+
+    first_rows = ~tickers.duplicated() & tickers.isin(selected) # the earliest predictor row of each ticker
+    results = pd.DataFrame({    'predicted_at': dates[first_rows],
+                                'prediction': model.predict(predictors[first_rows]) if first_rows.any() else [] }, index=tickers[first_rows])
+    results = results.join(metrics[['volatility', 'MAE', 'var_score', 'test_samples', 'alpha']])
+    results['potential'] = results['prediction'] * results['var_score'].clip(lower=0) * results['alpha'].clip(lower=0)
+    results.index.rename('ticker', inplace=True)
+    return results.sort_values('potential', ascending=False).round(2)
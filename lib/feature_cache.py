@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# On-disk cache of per-ticker features, extended incrementally as new bars arrive
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import os, urllib.parse
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+CACHE_DIR = BASE_DIR + '/../cache/features'
+
+WARMUP_PERIODS = 200 # bars of history new rows are recomputed from. TA-Lib's exponentially smoothed indicators (ATR, CMO, ADOSC, HT_*) converge well within this.
+INPUT_COLUMNS = [ 'open', 'high', 'low', 'close', 'volume', 'price' ]
+INPUT_PREFIX = '_input_'
+
+class FeatureCache:
+    """ Features of each ticker are stored along with the preprocessed bars they were computed from.
+        Cached rows are reused up to the first bar that was added or revised since, and only the rows after that are recomputed,
+        from a window of WARMUP_PERIODS bars before them. """
+    def __init__(self, version, lookback, lookfwd, resample, patterns=True, directory=CACHE_DIR):
+        self.directory = f"{directory}/v{version}-{lookback}-{lookfwd}-{resample}{'' if patterns else '-nopatterns'}"
+
+    def path(self, key):
+        return f"{self.directory}/{urllib.parse.quote(key, safe='')}.arrow"
+
+    def load(self, key):
+        try:
+            return feather.read_feather(self.path(key))
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+
+    def save(self, key, frame):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        feather.write_feather(frame, path + '.tmp') # write & rename, so that an interrupted run can't leave a partial file behind
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def unchanged_rows(cached, data):
+        """ Number of leading bars in data that are identical to the ones the cached features were computed from """
+        n = min(len(cached), len(data))
+        if n == 0 or not cached.index[:n].equals(data.index[:n]):
+            return 0
+        old = cached[[ INPUT_PREFIX + c for c in INPUT_COLUMNS ]].values[:n]
+        new = data[INPUT_COLUMNS].values[:n].astype('float64')
+        same = ((old == new) | (np.isnan(old) & np.isnan(new))).all(axis=1)
+        return n if same.all() else int(np.argmin(same))
+
+    def features(self, key, data, generate):
+        """ generate(data) as a DataFrame, reusing the cached rows wherever the underlying bars haven't changed """
+        cached = self.load(key)
+        valid = 0 if cached is None else self.unchanged_rows(cached, data)
+
+        if cached is not None and valid == len(data) == len(cached):
+            return cached.drop(columns=[ INPUT_PREFIX + c for c in INPUT_COLUMNS ])
+
+        if valid == 0:
+            frame = generate(data)
+        else:
+            window_start = max(0, valid - WARMUP_PERIODS)
+            new_rows = generate(data.iloc[window_start:]).iloc[(valid - window_start):]
+            old_rows = cached.iloc[:valid].drop(columns=[ INPUT_PREFIX + c for c in INPUT_COLUMNS ])
+            if list(new_rows.columns) != list(old_rows.columns): # e.g. a different set of pattern functions in a new TA-Lib version
+                frame = generate(data)
+            else:
+                frame = pd.concat([old_rows, new_rows], axis=0)
+
+        inputs = data[INPUT_COLUMNS].astype('float64').add_prefix(INPUT_PREFIX)
+        self.save(key, pd.concat([frame, inputs], axis=1))
+        return frame
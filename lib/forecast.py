@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Forecast providers for the f_forecast feature
+
+import numpy as np
+import pandas as pd
+import logging
+from scipy.signal import lfilter, lfilter_zi
+from lib.suppress_stdout_stderr import suppress_stdout_stderr
+
+logging.getLogger('fbprophet').setLevel(logging.WARNING)
+
+ALPHAS = [ .1, .2, .3, .5, .7, .9 ] # level smoothing constants to choose from
+BETAS  = [ .01, .05, .1, .2 ] # trend smoothing constants to choose from
+
+def holt_step(level, trend, sse, x, a, b):
+    """ One step of Holt's smoothing with constants a & b, given the new observations x. NaN observations leave the state as it is. """
+    observed = ~np.isnan(x)
+    started = ~np.isnan(level)
+    update = observed & started
+    err = np.where(update, x - (level + trend), 0)
+    sse = sse + err ** 2
+    new_level = np.where(update, a * x + (1 - a) * (level + trend), np.where(observed & ~started, x, level))
+    trend = np.where(update, b * (new_level - level) + (1 - b) * trend, trend)
+    return new_level, trend, sse
+
+def candidates(alphas=ALPHAS, betas=BETAS):
+    """ Every pair of the candidate smoothing constants, as two flat arrays """
+    a, b = (np.array(g, dtype='float64') for g in np.meshgrid(alphas, betas, indexing='ij'))
+    return a.ravel(), b.ravel()
+
+def holt_filter(x, a, b):
+    """ Level, trend and running sum of the squared one-step-ahead errors of Holt's smoothing of the observations x, with each pair
+        of constants a & b, as (time x pairs) arrays. The same recursion as holt_step(), run along the time axis as two linear filters:
+        level[t] = a * x[t] + (1 - a) * (level[t-1] + trend[t-1]) and trend[t] = b * (level[t] - level[t-1]) + (1 - b) * trend[t-1]
+        share the denominator 1 - (2 - a - a * b) z^-1 + (1 - a) z^-2. They start from level = x[0] and trend = 0, which is the filters'
+        steady state for a constant x[0]. """
+    level, trend = np.empty((len(x), len(a))), np.empty((len(x), len(a)))
+    for k, (ak, bk) in enumerate(zip(a, b)):
+        denominator = [ 1.0, -(2 - ak - ak * bk), 1 - ak ]
+        for out, numerator in ((level, [ ak, ak * (bk - 1) ]), (trend, [ ak * bk, -ak * bk ])):
+            out[:, k] = lfilter(numerator, denominator, x, zi=lfilter_zi(numerator, denominator) * x[0])[0]
+    level[0], trend[0] = x[0], 0.0 # exactly, so that every pair ties on the first error, as with holt_step()
+    errors = np.zeros(level.shape)
+    errors[1:] = x[1:, None] - (level[:-1] + trend[:-1])
+    return level, trend, np.cumsum(errors ** 2, axis=0)
+
+def holt_smoothing(close, lookfwd, alphas=ALPHAS, betas=BETAS):
+    """ Holt's linear trend exponential smoothing of each series of a (time x series) panel, with NaNs where a series has no observation.
+        At each point in time, the constants are chosen from the candidates by the least one-step-ahead squared error so far, so that
+        no forecast depends on later observations. Returns the lookfwd-periods-ahead forecast made at each observation, NaN elsewhere.
+        Each series is smoothed on its own, along the time axis, with every pair of constants at once. """
+    close = np.asarray(close, dtype='float64')
+    a, b = candidates(alphas, betas)
+    forecasts = np.full(close.shape, np.nan)
+    for j in range(close.shape[1]):
+        observed = ~np.isnan(close[:, j])
+        if observed.any():
+            level, trend, sse = holt_filter(close[observed, j], a, b)
+            best = np.argmin(sse, axis=1)[:, None]
+            forecasts[observed, j] = (np.take_along_axis(level, best, axis=1) + lookfwd * np.take_along_axis(trend, best, axis=1))[:, 0]
+    return forecasts
+
+class HoltState:
+    """ State of holt_smoothing() with every candidate pair of constants after the given (time x series) panel, from which the
+        forecast after one more observation of each series is made in O(1), the same as holt_smoothing() would make it
+        over the whole series. Series can be aligned on their last observation, with NaNs before they start. """
+    def __init__(self, close, alphas=ALPHAS, betas=BETAS):
+        close = np.asarray(close, dtype='float64')
+        self.a, self.b = candidates(alphas, betas)
+        shape = close.shape[1:] + self.a.shape
+        self.level, self.trend, self.sse = np.full(shape, np.nan), np.zeros(shape), np.zeros(shape)
+        for j in range(close.shape[1]):
+            observed = close[~np.isnan(close[:, j]), j]
+            if len(observed) > 0:
+                level, trend, sse = holt_filter(observed, self.a, self.b)
+                self.level[j], self.trend[j], self.sse[j] = level[-1], trend[-1], sse[-1]
+
+    def forecast(self, x, lookfwd):
+        """ lookfwd-periods-ahead forecast of each series after observing x, without keeping x in the state """
+        x = np.asarray(x, dtype='float64')[..., None]
+        level, trend, sse = holt_step(self.level, self.trend, self.sse, x, self.a, self.b)
+        best = np.argmin(sse, axis=-1)[..., None]
+        forecast = np.take_along_axis(level, best, axis=-1) + lookfwd * np.take_along_axis(trend, best, axis=-1)
+        return np.where(np.isnan(x), np.nan, forecast)[..., 0]
+
+def holt(d, lookfwd, resample):
+    """ Fast default: Holt's linear trend smoothing in NumPy """
+    return pd.Series(holt_smoothing(d['close'].values[:, None], lookfwd)[:, 0], index=d.index)
+
+def prophet(d, lookfwd, resample):
+    """ Facebook Prophet, fitted over the whole series. Slow, as it runs a Stan optimisation per series """
+    from fbprophet import Prophet # optional dependency, only needed when this provider is selected
+
+    dp = pd.concat([d.index.to_series(), d.close], axis=1)
+    dp.columns = ['ds', 'y']
+    with suppress_stdout_stderr():
+        m = Prophet(seasonality_mode='multiplicative').fit(dp)
+    ftr = m.make_future_dataframe(periods=lookfwd, freq=resample)
+    forecast = (m.predict(ftr).shift(-lookfwd))[['ds', 'yhat']]
+    return forecast.set_index('ds')['yhat']
+
+FORECASTERS = { 'holt': holt, 'prophet': prophet }
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# Vectorised, TA-Lib compatible technical indicators over (time x ticker) panels, and the same interface over TA-Lib for single tickers
+
+import numpy as np
+import talib as ta
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+TA_EPSILON = 0.00000001 # TA-Lib's TA_IS_ZERO() threshold
+
+def _pad(values, n, length):
+    """ Prepend n rows of NaNs, so that values line up with the length of the input, as TA-Lib's outputs do """
+    out = np.full((length,) + values.shape[1:], np.nan)
+    out[n:] = values[:(length - n)]
+    return out
+
+def _windows(x, n):
+    """ Read-only (time - n + 1, ..., n) view of the trailing windows of n periods, oldest first """
+    return sliding_window_view(x, n, axis=0)
+
+def _running_sum(x, n, start=0):
+    """ Sums over trailing windows of n periods, from index start onwards, accumulated the way TA-Lib does it:
+        one running total that each new value is added to and each trailing value subtracted from, so that rounding matches TA-Lib's """
+    out = np.full(x.shape, np.nan)
+    x = x[start:]
+    if len(x) < n:
+        return out
+    steps = np.empty((n + 2 * (len(x) - n),) + x.shape[1:])
+    steps[:n] = x[:n]
+    steps[n::2] = -x[:(len(x) - n)]
+    steps[(n + 1)::2] = x[n:]
+    out[(start + n - 1):] = np.cumsum(steps, axis=0)[(n - 1)::2]
+    return out
+
+def _divide(a, b, threshold=0.0):
+    """ a / b, or 0 where b is zero (or within threshold of zero), as TA-Lib does """
+    zero = np.abs(b) <= threshold if threshold else (b == 0)
+    return np.where(zero, 0.0, a / np.where(zero, 1.0, b))
+
+def _smooth(x, k, seed):
+    """ y[t] = k * x[t] + (1 - k) * y[t - 1], starting from y[-1] = seed, along the time axis """
+    return lfilter([k], [1, -(1 - k)], x, axis=0, zi=((1 - k) * seed)[None])[0]
+
+class Indicators:
+    """ Technical indicators over panels of (time x ticker) arrays, or single series, numerically equivalent to TA-Lib's.
+        Intermediates shared between indicators and across the periods of a ribbon (true range, rolling extremes,
+        rolling sums, typical price...) are computed once per panel and reused. Inputs are expected to be gap-free, as with TA-Lib. """
+    def __init__(self, open, high, low, close, volume):
+        self.open, self.high, self.low, self.close, self.volume = ( np.asarray(x, dtype='float64') for x in (open, high, low, close, volume) )
+        self.length = len(self.close)
+        self.cache = { }
+
+    def _memo(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    # ---------- shared intermediates ----------
+
+    def rolling_sum(self, name, x, n, start=0):
+        """ Sums over trailing windows of n periods from index start, aligned to the window end """
+        return self._memo(('sum', name, n, start), lambda: _running_sum(x, n, start))
+
+    def rolling_max(self, name, x, n):
+        return self._memo(('max', name, n), lambda: _pad(_windows(x, n).max(axis=-1), n - 1, len(x)))
+
+    def rolling_min(self, name, x, n):
+        return self._memo(('min', name, n), lambda: _pad(_windows(x, n).min(axis=-1), n - 1, len(x)))
+
+    def prev_close(self):
+        return self._memo('prev_close', lambda: _pad(self.close, 1, self.length))
+
+    def true_range(self):
+        """ TRANGE, NaN for the first period """
+        def compute():
+            pc = self.prev_close()
+            return np.fmax(self.high - self.low, np.fmax(np.abs(pc - self.high), np.abs(pc - self.low))) * np.where(np.isnan(pc), np.nan, 1)
+        return self._memo('true_range', compute)
+
+    def typical_price(self):
+        return self._memo('typical_price', lambda: (self.high + self.low + self.close) / 3)
+
+    def changes(self):
+        """ Gains and losses of the close price from one period to the next """
+        def compute():
+            delta = np.diff(self.close, axis=0)
+            return np.where(delta > 0, delta, 0.0), np.where(delta < 0, -delta, 0.0)
+        return self._memo('changes', compute)
+
+    def fast_k(self, n):
+        """ Raw stochastic %K, shared by STOCHF and STOCH """
+        def compute():
+            lowest, highest = self.rolling_min('low', self.low, n), self.rolling_max('high', self.high, n)
+            diff = (highest - lowest) / 100.0
+            return _divide(self.close - lowest, diff)
+        return self._memo(('fast_k', n), compute)
+
+    def sma(self, name, x, n, start):
+        """ Simple moving average of x, which has valid values from index start onwards """
+        return self._memo(('sma', name, n, start), lambda: self.rolling_sum(name, x, n, start) / n)
+
+    def accumulation_distribution(self):
+        def compute():
+            hl = self.high - self.low
+            clv = _divide((self.close - self.low) - (self.high - self.close), hl)
+            return np.cumsum(np.where(hl > 0, clv * self.volume, 0.0), axis=0)
+        return self._memo('ad', compute)
+
+    # ---------- indicators ----------
+
+    def AROONOSC(self, n):
+        w_high, w_low = _windows(self.high, n + 1), _windows(self.low, n + 1)
+        # TA-Lib takes the most recent extreme on ties
+        highest = n - np.argmax(w_high[..., ::-1], axis=-1)
+        lowest  = n - np.argmin(w_low[..., ::-1], axis=-1)
+        return _pad((100.0 / n) * (highest - lowest), n, self.length)
+
+    def ATR(self, n):
+        out = np.full(self.close.shape, np.nan)
+        if self.length <= n:
+            return out
+        tr = self.true_range()
+        seed = tr[1:(n + 1)].sum(axis=0) / n
+        out[n] = seed
+        out[(n + 1):] = _smooth(tr[(n + 1):], 1 / n, seed)
+        return out
+
+    def CORREL(self, n):
+        # sums of the values shifted by the first in each window, rather than running sums of squares of the raw values,
+        # which lose precision, and come out as exactly zero variance for flat windows
+        w_high, w_low = _windows(self.high, n), _windows(self.low, n)
+        x, y = w_high - w_high[..., :1], w_low - w_low[..., :1]
+        sx, sy = x.sum(axis=-1), y.sum(axis=-1)
+        denominator = ((x * x).sum(axis=-1) - ((sx * sx) / n)) * ((y * y).sum(axis=-1) - ((sy * sy) / n))
+        ok = denominator > 0
+        return _pad(np.where(ok, ((x * y).sum(axis=-1) - ((sx * sy) / n)) / np.sqrt(np.where(ok, denominator, 1.0)), 0.0), n - 1, self.length)
+
+    def BETA(self, n):
+        def returns(x):
+            previous = x[:-1]
+            ok = np.abs(previous) >= TA_EPSILON
+            return np.where(ok, (x[1:] - previous) / np.where(ok, previous, 1.0), 0.0)
+        x = self._memo('high_returns', lambda: returns(self.high))
+        y = self._memo('low_returns', lambda: returns(self.low))
+        w_x, w_y = _windows(x, n), _windows(y, n)
+        w_x, w_y = w_x - w_x[..., :1], w_y - w_y[..., :1]
+        sx, sy = w_x.sum(axis=-1), w_y.sum(axis=-1)
+        sxx, sxy = (w_x * w_x).sum(axis=-1), (w_x * w_y).sum(axis=-1)
+        return _pad(_divide((n * sxy) - (sx * sy), (n * sxx) - (sx * sx)), n, self.length)
+
+    def CMO(self, n):
+        out = np.full(self.close.shape, np.nan)
+        if self.length <= n:
+            return out
+        gains, losses = self.changes()
+        gain, loss = gains[:n].sum(axis=0) / n, losses[:n].sum(axis=0) / n
+        gain = np.concatenate([gain[None], _smooth(gains[n:], 1 / n, gain)])
+        loss = np.concatenate([loss[None], _smooth(losses[n:], 1 / n, loss)])
+        out[n:] = _divide(100 * (gain - loss), gain + loss, TA_EPSILON)
+        return out
+
+    def CCI(self, n):
+        tp = self.typical_price()
+        # TA-Lib keeps the window in a circular buffer, where each period sits at position (index % n), and sums it in buffer order
+        t = np.arange(n - 1, self.length)
+        buffer = [ tp[t - ((t - j) % n)] for j in range(n) ]
+        total = 0.0
+        for value in buffer:
+            total = total + value
+        average = total / n
+        deviations = 0.0
+        for value in buffer:
+            deviations = deviations + np.abs(value - average)
+        deviation = tp[(n - 1):] - average
+        ok = (np.abs(deviation) >= TA_EPSILON) & (np.abs(deviations) >= TA_EPSILON)
+        return _pad(np.where(ok, deviation / (0.015 * (np.where(ok, deviations, 1.0) / n)), 0.0), n - 1, self.length)
+
+    def LINEARREG_SLOPE(self, x, n):
+        sum_x = n * (n - 1) * 0.5
+        sum_x_sqr = n * (n - 1) * (2 * n - 1) / 6
+        divisor = sum_x * sum_x - n * sum_x_sqr
+        w = _windows(np.asarray(x, dtype='float64'), n)
+        sum_xy, sum_y = 0.0, 0.0
+        for j in range(n): # oldest first, with x counting backwards from the most recent period, as TA-Lib does
+            sum_y = sum_y + w[..., j]
+            sum_xy = sum_xy + (n - 1 - j) * w[..., j]
+        return _pad((n * sum_xy - sum_x * sum_y) / divisor, n - 1, len(x))
+
+    def STOCHF_K(self, fastk_period, fastd_period):
+        """ STOCHF's fastk output, which TA-Lib only starts once fastd is available """
+        out = self.fast_k(fastk_period).copy()
+        out[:(fastk_period + fastd_period - 2)] = np.nan
+        return out
+
+    def STOCH(self, fastk_period, slowk_period, slowd_period):
+        """ STOCH's (slowk, slowd) outputs, computed together """
+        start = fastk_period - 1
+        slowk = self.sma(('fast_k', fastk_period), self.fast_k(fastk_period), slowk_period, start)
+        slowd = self.sma(('slow_k', fastk_period, slowk_period), slowk, slowd_period, start + slowk_period - 1).copy()
+        slowk = slowk.copy()
+        slowk[:(start + slowk_period + slowd_period - 2)] = np.nan
+        return slowk, slowd
+
+    def ULTOSC(self, period1, period2, period3):
+        period1, period2, period3 = sorted((period1, period2, period3))
+        def compute_terms():
+            pc = self.prev_close()
+            buying_pressure = self.close - np.fmin(self.low, pc)
+            buying_pressure[0] = np.nan
+            return buying_pressure
+        buying_pressure = self._memo('buying_pressure', compute_terms)
+        tr = self.true_range()
+        out = np.zeros(self.close.shape)
+        for weight, n in ((4.0, period1), (2.0, period2), (1.0, period3)):
+            # TA-Lib starts each running total just in time for the first output, at index period3
+            bp_sum = self.rolling_sum('buying_pressure', buying_pressure, n, period3 - n + 1)
+            tr_sum = self.rolling_sum('true_range', tr, n, period3 - n + 1)
+            out += weight * _divide(bp_sum, tr_sum, TA_EPSILON)
+        out = 100.0 * (out / 7.0)
+        out[:period3] = np.nan
+        return out
+
+    def ADOSC(self, fastperiod, slowperiod):
+        ad = self.accumulation_distribution()
+        fast = _smooth(ad, 2.0 / (fastperiod + 1), ad[0])
+        slow = _smooth(ad, 2.0 / (slowperiod + 1), ad[0])
+        out = fast - slow
+        out[:(max(fastperiod, slowperiod) - 1)] = np.nan
+        return out
+
+class TALib:
+    """ The ribbon indicators of Indicators for a single ticker's series, computed by TA-Lib itself.
+        Over whole histories, TA-Lib's C loops are faster ticker by ticker than the NumPy engine is even over panels of hundreds of tickers,
+        so the batch build uses this, and Indicators is kept for the short trailing windows of the intraday engine. """
+    def __init__(self, open, high, low, close, volume):
+        self.open, self.high, self.low, self.close, self.volume = ( np.ascontiguousarray(x, dtype='float64') for x in (open, high, low, close, volume) )
+
+    def AROONOSC(self, n):
+        return ta.AROONOSC(self.high, self.low, timeperiod=n)
+
+    def ATR(self, n):
+        return ta.ATR(self.high, self.low, self.close, timeperiod=n)
+
+    def CORREL(self, n):
+        return ta.CORREL(self.high, self.low, timeperiod=n)
+
+    def BETA(self, n):
+        return ta.BETA(self.high, self.low, timeperiod=n)
+
+    def CMO(self, n):
+        return ta.CMO(self.close, timeperiod=n)
+
+    def CCI(self, n):
+        return ta.CCI(self.high, self.low, self.close, timeperiod=n)
+
+    def LINEARREG_SLOPE(self, x, n):
+        return ta.LINEARREG_SLOPE(x, timeperiod=n)
+
+    def STOCHF_K(self, fastk_period, fastd_period):
+        return ta.STOCHF(self.high, self.low, self.close, fastk_period=fastk_period, fastd_period=fastd_period)[0]
+
+    def STOCH(self, fastk_period, slowk_period, slowd_period):
+        return ta.STOCH(self.high, self.low, self.close, fastk_period=fastk_period, slowk_period=slowk_period, slowd_period=slowd_period)
+
+    def ULTOSC(self, period1, period2, period3):
+        return ta.ULTOSC(self.high, self.low, self.close, timeperiod1=period1, timeperiod2=period2, timeperiod3=period3)
+
+    def ADOSC(self, fastperiod, slowperiod):
+        return ta.ADOSC(self.high, self.low, self.close, self.volume, fastperiod=fastperiod, slowperiod=slowperiod)
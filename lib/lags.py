@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Lookback ('past value') features, stored once per period and expanded only when the model input is built
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+def past_values(base, rows, lookback, out=None):
+    """ Values of base lagged by 2 to lookback periods for each of the given rows, as an (n x columns x lags) array.
+        The lags are gathered from a windowed view over base, so that the only copy made is the output, or into out if given. """
+    lags = lookback - 1
+    windows = sliding_window_view(base, lags, axis=0)[..., ::-1] # windows[j] holds base[j + lags - 1], ..., base[j], newest first
+    if out is None:
+        out = np.empty((len(rows), base.shape[1], lags), dtype=base.dtype)
+    np.take(windows, np.asarray(rows) - lookback, axis=0, out=out)
+    return out
+
+class Lags:
+    """ Past values of the given feature columns across all tickers. Each ticker's series is stored once, in one base array,
+        preceded by lookback rows of NaNs so that no window reaches into the previous ticker's series.
+        Samples refer to their own row of the base array through a 'lag_row' column. """
+    def __init__(self, columns, lookback, dtype='float64'):
+        self.columns = columns
+        self.lookback = lookback
+        self.base = np.empty((0, len(columns)), dtype=dtype)
+
+    @property
+    def names(self):
+        return [ f'f_past_{c[2:]}_{i}' for c in self.columns for i in range(2, (self.lookback + 1)) ]
+
+    def ticker_base(self, d):
+        """ The base array of a single ticker's series, and the rows of it that the samples of d refer to """
+        base = np.concatenate([ np.full((self.lookback, len(self.columns)), np.nan, dtype=self.base.dtype), d[self.columns].values.astype(self.base.dtype) ])
+        return base, np.arange(self.lookback, len(base))
+
+    def complete(self, base, rows):
+        """ Mask of the rows that have all of their past values available """
+        return ~np.isnan(past_values(base, rows, self.lookback)).any(axis=(1, 2))
+
+    def extend(self, bases):
+        """ Append the base arrays of some tickers, returning the offset each one's rows have to be moved by """
+        offsets = np.cumsum([ len(self.base) ] + [ len(b) for b in bases[:-1] ])
+        self.base = np.concatenate([ self.base ] + bases)
+        return offsets
+
+    def features(self, frame, out=None):
+        """ Past values for the samples in frame, as an (n x names) array, written into out if given """
+        if out is not None:
+            out = out.reshape(len(frame), len(self.columns), self.lookback - 1)
+        return past_values(self.base, frame['lag_row'].values, self.lookback, out).reshape(len(frame), len(self.names))
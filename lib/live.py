@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# Intraday re-scoring: each ticker's featurized history is kept in memory and only today's bar is updated with each snapshot
+
+import numpy as np
+import pandas as pd
+from time import perf_counter
+import lib.tickers as ticker_lists
+from lib.feature_cache import WARMUP_PERIODS
+from lib.forecast import HoltState, holt
+from lib.indicators import Indicators
+from lib.lags import past_values
+
+BAR_COLUMNS = [ 'open', 'high', 'low', 'close', 'volume', 'price' ]
+
+class IntradayEngine:
+    """ Makes the predictor row of each ticker for today from a snapshot of its intraday prices, as DataSet(intraday=True) would,
+        without going over its history again. At warm up, each series (the tickers and their market indices) is preprocessed once,
+        up to today, and what the features of today's bar depend on is kept: the part of today's bar from the days before it,
+        the last WARMUP_PERIODS bars for the indicators, the state of the price forecast, the sums behind the relative volume,
+        and the rows that the lookback features are taken from. A snapshot then only updates today's bar and the indicators
+        over the trailing window, for all tickers at once. Indicators that are smoothed over the whole history (ATR, CMO, ADOSC,
+        HT_TRENDMODE) come out as they would from the full history once the window is long enough for them to converge. """
+    def __init__(self, ds, today, window=WARMUP_PERIODS, verbose=1):
+        """ ds: a DataSet configured as the model's one was, e.g. with build=False, today: the day the snapshots are taken on """
+        if ds.forecaster is not holt:
+            raise ValueError('the intraday engine can only update the holt forecast')
+        self.ds, self.today, self.window, self.verbose = ds, pd.Timestamp(today), window, verbose
+        time_start = perf_counter()
+
+        raw_data = ds.fetch_data()
+        indices = [ i for i in ticker_lists.indices() if i[0] in ds.markets ]
+        self.keys, states = [ ], [ ]
+        for key in indices + sorted(ds.tickers):
+            state = self.warm_up(raw_data.pop(key, None))
+            if state is not None:
+                self.keys.append(key)
+                states.append(state)
+        self.position = { k: j for j, k in enumerate(self.keys) }
+        self.is_index = np.array([ k[1].startswith('^') for k in self.keys ])
+        self.index_of = np.array([ self.position.get(next((i for i in indices if i[0] == k[0]), None), -1) for k in self.keys ])
+
+        n = len(self.keys)
+        stack = lambda name: np.array([ s[name] for s in states ], dtype='float64').reshape(n)
+        self.partial = { c: stack('partial_' + c) for c in [ 'open', 'high', 'low', 'volume' ] }
+        self.last_raw_close, self.last_close, self.last_price = stack('last_raw_close'), stack('last_close'), stack('last_price')
+        self.volume_sum, self.price_sum, self.count = stack('volume_sum'), stack('price_sum'), stack('count')
+
+        # the price forecast's state, with the closes aligned on the last bar
+        closes = np.full((max([ len(s['closes']) for s in states ] + [ 1 ]), n), np.nan)
+        for j, s in enumerate(states):
+            closes[len(closes) - len(s['closes']):, j] = s['closes']
+        self.holt = HoltState(closes)
+
+        # the last window - 1 bars of each series, with today's appended to them on each update
+        self.bars = { c: np.full((window, n), np.nan) for c in BAR_COLUMNS }
+        self.lengths = np.array([ min(len(s['tail']), window - 1) for s in states ], dtype='int64')
+        for j, s in enumerate(states):
+            tail = s['tail'][-(window - 1):]
+            for k, c in enumerate(BAR_COLUMNS):
+                self.bars[c][(window - 1 - len(tail)):(window - 1), j] = tail[:, k]
+
+        # rows of the lookback features before today's: ticker & index price changes and relative volume, on the dates of either
+        lookback = ds.lookback
+        self.lag_rows = { c: np.full((n, lookback), np.nan) for c in [ 'pc', 'ipc', 'f_volume' ] }
+        for j, s in enumerate(states):
+            if self.is_index[j] or self.index_of[j] < 0:
+                continue
+            rows = pd.concat([ s['history'], states[self.index_of[j]]['history']['pc'].rename('ipc') ], axis=1, sort=False).iloc[-lookback:]
+            for c in self.lag_rows:
+                self.lag_rows[c][j, (lookback - len(rows)):] = rows[c].values
+
+        self.names = None
+        if verbose > 0:
+            print('intraday engine warmed up with', n, 'series in', round(perf_counter() - time_start, 1), 'seconds')
+
+    def warm_up(self, data):
+        """ What today's features of a series depend on, from its history before today. None if it can't have a bar today. """
+        if data is None or len(data) == 0:
+            return None
+        data = data[pd.to_datetime(data.index) < self.today]
+        if len(data) == 0 or (self.today - pd.to_datetime(data.index).max()).days > 365: # gap detection would drop the history
+            return None
+
+        # a stand-in for today's snapshot, so that the days before it are padded as they are when the snapshot is added
+        today = data.iloc[[-1]].copy()
+        today.index = pd.DatetimeIndex([ self.today ], name=data.index.name)
+        daily = self.ds.daily_bars(pd.concat([ data, today ]))
+        if len(daily) < 2 or daily.index[-1] != self.today:
+            return None
+
+        if self.ds.resample == 'no':
+            start = len(daily) - 1
+        else:
+            firsts = pd.Series(np.arange(len(daily)), index=daily.index).resample(self.ds.resample).min()
+            if firsts.index[-1] != self.today:
+                raise ValueError(f'the {self.ds.resample} bar with today in it is labelled {firsts.index[-1].date()}, so it would be dropped, '
+                                 f'as it is in the batch pipeline. Use a rule that labels it with today, e.g. W-{self.today.strftime("%a").upper()}')
+            start = int(firsts.iloc[-1])
+        partial = daily.iloc[start:-1]
+
+        resampled = self.ds.resample_bars(daily.iloc[:start].copy())
+        closes = resampled['close'].values.copy()
+        history = self.ds.derive(resampled)
+        if history is None or len(history) < self.ds.lookback:
+            return None
+
+        return {    'partial_open': partial['open'].iloc[0] if len(partial) > 0 else np.nan,
+                    'partial_high': partial['high'].max() if len(partial) > 0 else np.nan,
+                    'partial_low': partial['low'].min() if len(partial) > 0 else np.nan,
+                    'partial_volume': partial['volume'].sum(),
+                    'last_raw_close': daily['close'].iloc[-2],
+                    'last_close': history['close'].iloc[-1], 'last_price': history['price'].iloc[-1],
+                    'volume_sum': history['volume'].sum(), 'price_sum': history['price'].sum(), 'count': len(history),
+                    'closes': closes,
+                    'tail': history[BAR_COLUMNS].values[-(self.window - 1):].astype('float64'),
+                    'history': history[[ 'pc' ]].assign(f_volume=self.ds.relative_volume(history['volume'], history['price'])).iloc[-self.ds.lookback:] }
+
+    def today_bars(self, snapshot):
+        """ Today's bar of each series, from the snapshot's prices imputed as daily_bars() does and the part of the bar before today """
+        rows = snapshot.reset_index()
+        rows = rows[pd.to_datetime(rows['date']) == self.today]
+        positions = np.array([ self.position.get((m, t), -1) for m, t in zip(rows['market'], rows['ticker']) ], dtype='int64')
+        order = np.argsort(np.where(positions >= 0, positions, len(self.keys)), kind='stable')[:(positions >= 0).sum()]
+        rows, positions = rows.iloc[order], positions[order] # in the order of the series, which update() looks them up by
+        o, h, l, c, v = ( rows[col].values.astype('float64') for col in [ 'open', 'high', 'low', 'close', 'volume' ] )
+
+        c = np.where((c == 0) | np.isnan(c), self.last_raw_close[positions], c)
+        o = np.where(o == 0, self.last_raw_close[positions], o)
+        h = np.where(h == 0, np.where(c > o, c, o), h)
+        l = np.where(l == 0, np.where(c > o, o, c), l)
+        if self.today.weekday() > 4:
+            v = np.zeros_like(v)
+
+        po, ph, pl, pv = ( self.partial[col][positions] for col in [ 'open', 'high', 'low', 'volume' ] )
+        bar = { 'open': np.where(np.isnan(po), o, po), 'high': np.fmax(ph, h), 'low': np.fmin(pl, l), 'close': c, 'volume': pv + v }
+        bar['price'] = (bar['open'] + bar['close']) / 2
+        return positions, bar
+
+    def ta_features(self, positions, prefix):
+        """ TA features of today's bar of the given series """
+        window, columns = self.bars, { }
+        full = positions[self.lengths[positions] == self.window - 1]
+        groups = [ (full, slice(None)) ] + [ (positions[[k]], slice(self.window - 1 - self.lengths[j], None))
+                                              for k, j in enumerate(positions) if self.lengths[j] < self.window - 1 ]
+        for group, rows in groups:
+            if len(group) == 0:
+                continue
+            o, h, l, c, v, p = ( window[col][rows][:, group] for col in BAR_COLUMNS )
+            for values, name in self.ds.ribbon_features(Indicators(o, h, l, c, v), p, prefix):
+                columns.setdefault(name, np.full(len(self.keys), np.nan))[group] = values[-1]
+            for k, j in enumerate(group): # TA-Lib takes one series at a time
+                series = [ np.ascontiguousarray(x[:, k]) for x in (o, h, l, c, v) ]
+                for values, name in self.ds.talib_features(*series, prefix):
+                    if name not in columns:
+                        columns[name] = np.full(len(self.keys), np.nan)
+                    columns[name][j] = values[-1]
+        return columns
+
+    def update(self, snapshot):
+        """ Predictor rows of the tickers in the snapshot (a frame in lib.intraday.parse()'s format), indexed by date and ticker,
+            with the columns of model_input() """
+        ds, lookback = self.ds, self.ds.lookback
+        positions, bar = self.today_bars(snapshot)
+        for col in BAR_COLUMNS:
+            self.bars[col][-1] = np.nan
+            self.bars[col][-1, positions] = bar[col]
+
+        pc = np.full(len(self.keys), np.nan)
+        pc[positions] = (bar['price'] / self.last_price[positions] - 1) * 100
+        volume_mean = (self.volume_sum[positions] + bar['volume']) / (self.count[positions] + 1)
+        price_mean = (self.price_sum[positions] + bar['price']) / (self.count[positions] + 1)
+        close = np.full(len(self.keys), np.nan)
+        close[positions] = bar['close']
+        forecast = self.holt.forecast(close, ds.lookfwd)[positions]
+
+        tickers = positions[~self.is_index[positions] & (self.index_of[positions] >= 0)]
+        t = np.searchsorted(positions, tickers) # where the tickers' bars are
+        ipc = pc[self.index_of[tickers]]
+        own = { # in the order ts_data() makes them
+                'f_gap': (bar['open'][t] - self.last_close[tickers]) / bar['price'][t],
+                'f_spread': (bar['high'][t] - bar['low'][t]) / bar['price'][t],
+                'f_spc': pc[tickers],
+                'f_volume': (bar['volume'][t] / volume_mean[t]) * (bar['price'][t] / price_mean[t]),
+                'f_forecast': forecast[t] / bar['close'][t],
+                'f_ipc': ipc,
+                'f_spc_minus_ipc': pc[tickers] - ipc }
+        if ds.ta:
+            own.update({ name: values[tickers] for name, values in self.ta_features(tickers, 'f_').items() })
+            indices = np.unique(self.index_of[tickers])
+            market = { name: values[self.index_of[tickers]] for name, values in self.ta_features(indices[indices >= 0], 'f_i_').items() }
+        else:
+            market = { }
+
+        # lookback features from the rows before today's
+        lag_base = np.full((len(tickers), lookback + 1, len(ds.lags.columns)), np.nan)
+        past = {    'f_spc': self.lag_rows['pc'][tickers], 'f_ipc': self.lag_rows['ipc'][tickers],
+                    'f_spc_minus_ipc': self.lag_rows['pc'][tickers] - self.lag_rows['ipc'][tickers],
+                    'f_volume': self.lag_rows['f_volume'][tickers] }
+        for k, c in enumerate(ds.lags.columns):
+            lag_base[:, :lookback, k] = past[c]
+            lag_base[:, lookback, k] = own[c]
+        lags = np.stack([ past_values(b, [ lookback ], lookback).reshape(-1) for b in lag_base ]) if len(tickers) > 0 else np.empty((0, len(ds.lags.names)))
+
+        names = list(own) + list(market) + ds.lags.names
+        X = np.column_stack([ own[c] for c in own ] + [ market[c] for c in market ] + [ lags ]) if len(tickers) > 0 else np.empty((0, len(names)))
+        index = pd.MultiIndex.from_arrays([ pd.DatetimeIndex([ self.today ] * len(tickers)), [ '_'.join(self.keys[j]) for j in tickers ] ], names=[ 'date', 'ticker' ])
+        return pd.DataFrame(X.astype(ds.dtype), index=index, columns=names)
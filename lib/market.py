@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Market (index) features, stored once per market and joined to the ticker samples when the model input is built
+
+import numpy as np
+import pandas as pd
+
+class MarketFeatures:
+    """ One table of features per market, indexed by date, shared by all the tickers of the market
+        instead of being copied into each of their frames """
+    def __init__(self, dtype='float64'):
+        self.tables = { }
+        self.dtype = dtype
+
+    def add(self, market, features):
+        """ Add the features of a market, given as a list of (Series, name) tuples """
+        table = pd.concat([ f[0] for f in features ], axis=1)
+        table.columns = [ f[1] for f in features ]
+        self.tables[market] = table.astype(self.dtype)
+
+    @property
+    def columns(self):
+        return next(iter(self.tables.values())).columns if self.tables else pd.Index([])
+
+    def complete(self, market):
+        """ Dates on which all of the market's features are available """
+        table = self.tables[market]
+        return table.index[table.notnull().all(axis=1).values]
+
+    def features(self, frame, out=None):
+        """ Features of the market of each sample in frame on the sample's date, as an (n x columns) array, written into out if given """
+        if out is None:
+            out = np.empty((len(frame), len(self.columns)), dtype=self.dtype)
+        out[:] = np.nan
+        dates, markets = frame.index.get_level_values('date'), frame['market'].values
+        for market, table in self.tables.items():
+            rows = np.flatnonzero(markets == market)
+            if len(rows) == 0:
+                continue
+            positions = table.index.get_indexer(dates[rows])
+            values = table.values[positions]
+            values[positions < 0] = np.nan
+            out[rows] = values
+        return out
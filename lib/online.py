@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# Online technical indicators: state machines updated one bar at a time, numerically equivalent to TA-Lib's
+
+import numpy as np
+from lib.indicators import TA_EPSILON, _divide
+
+def _nan(x):
+    return np.full(np.shape(x), np.nan)
+
+class _Window:
+    """ The last n values of each ticker, in a circular buffer where the value of bar i sits at position i % n, as in TA-Lib """
+    def __init__(self, n):
+        self.n, self.values, self.count = n, None, 0
+
+    def push(self, x):
+        x = np.asarray(x, dtype='float64')
+        if self.values is None:
+            self.values = np.full((self.n,) + x.shape, np.nan)
+        self.values[self.count % self.n] = x
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.n
+
+    def oldest(self):
+        return self.values[self.count % self.n]
+
+    def ordered(self):
+        """ The window oldest first """
+        return np.roll(self.values, -(self.count % self.n), axis=0)
+
+class _RunningSum:
+    """ Sum of the last n values, kept as one running total that each new value is added to and each trailing value
+        subtracted from, so that rounding matches TA-Lib's """
+    def __init__(self, n):
+        self.window, self.total = _Window(n), 0.0
+
+    def push(self, x):
+        if self.window.full:
+            self.total = self.total - self.window.oldest()
+        self.total = self.total + x
+        self.window.push(x)
+        return self.total if self.window.full else _nan(x)
+
+class Online:
+    """ An indicator over a panel of tickers that all get a new bar at the same time. update() takes the bar's open, high, low,
+        close & volume (scalars, or arrays with one value per ticker) and returns the indicator's value on it, NaN until TA-Lib's
+        lookback is reached. An update costs the same however long the history is. """
+    def update(self, open, high, low, close, volume):
+        raise NotImplementedError
+
+    def seed(self, open, high, low, close, volume):
+        """ Feed a (time x tickers) history, bar by bar. Returns the value on its last bar. """
+        value = None
+        for bar in zip(open, high, low, close, volume):
+            value = self.update(*bar)
+        return value
+
+class ATR(Online):
+    def __init__(self, n):
+        self.n, self.prev_close, self.count, self.value = n, None, 0, 0.0
+
+    def update(self, open, high, low, close, volume):
+        out = _nan(close)
+        if self.prev_close is not None:
+            pc = self.prev_close
+            tr = np.fmax(high - low, np.fmax(np.abs(pc - high), np.abs(pc - low)))
+            self.count += 1
+            if self.count <= self.n: # seeded with the average of the first n true ranges
+                self.value = self.value + tr
+                if self.count == self.n:
+                    self.value = self.value / self.n
+            else:
+                self.value = (1 / self.n) * tr + (1 - 1 / self.n) * self.value
+            if self.count >= self.n:
+                out = self.value
+        self.prev_close = close
+        return out
+
+class CMO(Online):
+    def __init__(self, n):
+        self.n, self.prev_close, self.count, self.gain, self.loss = n, None, 0, 0.0, 0.0
+
+    def update(self, open, high, low, close, volume):
+        out = _nan(close)
+        if self.prev_close is not None:
+            delta = close - self.prev_close
+            gain, loss = np.where(delta > 0, delta, 0.0), np.where(delta < 0, -delta, 0.0)
+            self.count += 1
+            if self.count <= self.n:
+                self.gain, self.loss = self.gain + gain, self.loss + loss
+                if self.count == self.n:
+                    self.gain, self.loss = self.gain / self.n, self.loss / self.n
+            else:
+                self.gain = (1 / self.n) * gain + (1 - 1 / self.n) * self.gain
+                self.loss = (1 / self.n) * loss + (1 - 1 / self.n) * self.loss
+            if self.count >= self.n:
+                out = _divide(100 * (self.gain - self.loss), self.gain + self.loss, TA_EPSILON)
+        self.prev_close = close
+        return out
+
+class CCI(Online):
+    def __init__(self, n):
+        self.n, self.window = n, _Window(n)
+
+    def update(self, open, high, low, close, volume):
+        tp = (high + low + close) / 3
+        self.window.push(tp)
+        if not self.window.full:
+            return _nan(close)
+        total = 0.0
+        for value in self.window.values: # summed in buffer order, as TA-Lib does
+            total = total + value
+        average = total / self.n
+        deviations = 0.0
+        for value in self.window.values:
+            deviations = deviations + np.abs(value - average)
+        deviation = tp - average
+        ok = (np.abs(deviation) >= TA_EPSILON) & (np.abs(deviations) >= TA_EPSILON)
+        return np.where(ok, deviation / (0.015 * (np.where(ok, deviations, 1.0) / self.n)), 0.0)
+
+class AROONOSC(Online):
+    def __init__(self, n):
+        self.n, self.highs, self.lows = n, _Window(n + 1), _Window(n + 1)
+
+    def update(self, open, high, low, close, volume):
+        self.highs.push(high)
+        self.lows.push(low)
+        if not self.highs.full:
+            return _nan(close)
+        # TA-Lib takes the most recent extreme on ties
+        highest = self.n - np.argmax(self.highs.ordered()[::-1], axis=0)
+        lowest = self.n - np.argmin(self.lows.ordered()[::-1], axis=0)
+        return (100.0 / self.n) * (highest - lowest)
+
+class CORREL(Online):
+    """ Correlation of the high and low prices """
+    def __init__(self, n):
+        self.n, self.highs, self.lows = n, _Window(n), _Window(n)
+
+    def update(self, open, high, low, close, volume):
+        self.highs.push(high)
+        self.lows.push(low)
+        if not self.highs.full:
+            return _nan(close)
+        x, y = self.highs.ordered(), self.lows.ordered()
+        x, y = x - x[0], y - y[0]
+        sx, sy = x.sum(axis=0), y.sum(axis=0)
+        denominator = ((x * x).sum(axis=0) - ((sx * sx) / self.n)) * ((y * y).sum(axis=0) - ((sy * sy) / self.n))
+        ok = denominator > 0
+        return np.where(ok, ((x * y).sum(axis=0) - ((sx * sy) / self.n)) / np.sqrt(np.where(ok, denominator, 1.0)), 0.0)
+
+class BETA(Online):
+    """ Beta of the returns of the low price to the returns of the high price """
+    def __init__(self, n):
+        self.n, self.prev_high, self.prev_low, self.x, self.y = n, None, None, _Window(n), _Window(n)
+
+    @staticmethod
+    def returns(x, previous):
+        ok = np.abs(previous) >= TA_EPSILON
+        return np.where(ok, (x - previous) / np.where(ok, previous, 1.0), 0.0)
+
+    def update(self, open, high, low, close, volume):
+        if self.prev_high is not None:
+            self.x.push(self.returns(high, self.prev_high))
+            self.y.push(self.returns(low, self.prev_low))
+        self.prev_high, self.prev_low = high, low
+        if not self.x.full:
+            return _nan(close)
+        x, y = self.x.ordered(), self.y.ordered()
+        x, y = x - x[0], y - y[0]
+        sx, sy = x.sum(axis=0), y.sum(axis=0)
+        sxx, sxy = (x * x).sum(axis=0), (x * y).sum(axis=0)
+        return _divide((self.n * sxy) - (sx * sy), (self.n * sxx) - (sx * sx))
+
+class LINEARREG_SLOPE(Online):
+    """ Slope of the linear regression of the close price, or of the volume with column='volume' """
+    def __init__(self, n, column='close'):
+        self.n, self.column, self.window = n, column, _Window(n)
+
+    def update(self, open, high, low, close, volume):
+        self.window.push(volume if self.column == 'volume' else close)
+        if not self.window.full:
+            return _nan(close)
+        n = self.n
+        sum_x = n * (n - 1) * 0.5
+        sum_x_sqr = n * (n - 1) * (2 * n - 1) / 6
+        w = self.window.ordered()
+        sum_xy, sum_y = 0.0, 0.0
+        for j in range(n): # oldest first, with x counting backwards from the most recent period, as TA-Lib does
+            sum_y = sum_y + w[j]
+            sum_xy = sum_xy + (n - 1 - j) * w[j]
+        return (n * sum_xy - sum_x * sum_y) / (sum_x * sum_x - n * sum_x_sqr)
+
+class _FastK:
+    """ Raw stochastic %K, shared by STOCHF and STOCH """
+    def __init__(self, n):
+        self.highs, self.lows = _Window(n), _Window(n)
+
+    def update(self, high, low, close):
+        self.highs.push(high)
+        self.lows.push(low)
+        if not self.highs.full:
+            return _nan(close)
+        lowest, highest = self.lows.values.min(axis=0), self.highs.values.max(axis=0)
+        return _divide(close - lowest, (highest - lowest) / 100.0)
+
+class STOCHF_K(Online):
+    """ STOCHF's fastk output, which TA-Lib only starts once fastd is available """
+    def __init__(self, fastk_period, fastd_period):
+        self.fast_k, self.start, self.count = _FastK(fastk_period), fastk_period + fastd_period - 2, 0
+
+    def update(self, open, high, low, close, volume):
+        value = self.fast_k.update(high, low, close)
+        self.count += 1
+        return value if self.count > self.start else _nan(close)
+
+class STOCH(Online):
+    """ STOCH's (slowk, slowd) outputs, computed together """
+    def __init__(self, fastk_period, slowk_period, slowd_period):
+        self.fast_k, self.slowk_period, self.slowd_period = _FastK(fastk_period), slowk_period, slowd_period
+        self.slowk_sum, self.slowd_sum = _RunningSum(slowk_period), _RunningSum(slowd_period)
+        self.start, self.count = fastk_period + slowk_period + slowd_period - 3, 0
+
+    def update(self, open, high, low, close, volume):
+        fast_k = self.fast_k.update(high, low, close)
+        slowk = slowd = _nan(close)
+        if self.fast_k.highs.full:
+            slowk = self.slowk_sum.push(fast_k) / self.slowk_period
+            if self.slowk_sum.window.full:
+                slowd = self.slowd_sum.push(slowk) / self.slowd_period
+        self.count += 1
+        return (slowk, slowd) if self.count > self.start else (_nan(close), _nan(close))
+
+class ULTOSC(Online):
+    def __init__(self, period1, period2, period3):
+        self.periods = sorted((period1, period2, period3))
+        self.sums = [ (_RunningSum(n), _RunningSum(n)) for n in self.periods ]
+        self.prev_close, self.count = None, 0
+
+    def update(self, open, high, low, close, volume):
+        out = _nan(close)
+        if self.prev_close is not None:
+            pc = self.prev_close
+            buying_pressure = close - np.fmin(low, pc)
+            tr = np.fmax(high - low, np.fmax(np.abs(pc - high), np.abs(pc - low)))
+            total = 0.0
+            for weight, n, (bp_sum, tr_sum) in zip((4.0, 2.0, 1.0), self.periods, self.sums):
+                # TA-Lib starts each running total just in time for the first output, at bar period3
+                if self.count >= self.periods[-1] - n:
+                    total = total + weight * _divide(bp_sum.push(buying_pressure), tr_sum.push(tr), TA_EPSILON)
+            self.count += 1
+            if self.count >= self.periods[-1]:
+                out = 100.0 * (total / 7.0)
+        self.prev_close = close
+        return out
+
+class ADOSC(Online):
+    def __init__(self, fastperiod, slowperiod):
+        self.fast_k, self.slow_k = 2.0 / (fastperiod + 1), 2.0 / (slowperiod + 1)
+        self.start, self.count, self.ad, self.fast, self.slow = max(fastperiod, slowperiod) - 1, 0, 0.0, None, None
+
+    def update(self, open, high, low, close, volume):
+        hl = high - low
+        clv = _divide((close - low) - (high - close), hl)
+        self.ad = self.ad + np.where(hl > 0, clv * volume, 0.0)
+        if self.fast is None: # both averages start from the first value
+            self.fast = self.slow = self.ad
+        self.fast = self.fast_k * self.ad + (1 - self.fast_k) * self.fast
+        self.slow = self.slow_k * self.ad + (1 - self.slow_k) * self.slow
+        self.count += 1
+        return self.fast - self.slow if self.count > self.start else _nan(close)
+
+class MFI(Online):
+    def __init__(self, n=14):
+        self.n, self.prev_tp, self.positive, self.negative = n, None, _RunningSum(n), _RunningSum(n)
+
+    def update(self, open, high, low, close, volume):
+        tp = (high + low + close) / 3
+        out = _nan(close)
+        if self.prev_tp is not None:
+            flow, change = tp * volume, tp - self.prev_tp
+            positive = self.positive.push(np.where(change > 0, flow, 0.0))
+            negative = self.negative.push(np.where(change < 0, flow, 0.0))
+            if self.positive.window.full:
+                total = positive + negative
+                out = np.where(total < 1.0, 0.0, 100.0 * (positive / np.where(total < 1.0, 1.0, total)))
+        self.prev_tp = tp
+        return out
+
+class BOP(Online):
+    """ Balance of power, which only depends on the bar itself """
+    def update(self, open, high, low, close, volume):
+        return _divide(close - open, high - low, TA_EPSILON)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Stage timings and memory use of a run, gathered across the pool workers, with optional cProfile dumps
+
+import pandas as pd
+import contextlib, cProfile, glob, json, multiprocessing.util, os, pstats, psutil
+from time import perf_counter
+
+MB = 2 ** 20
+
+def rss():
+    return psutil.Process(os.getpid()).memory_info().rss
+
+def stage(profile, name, ticker=None):
+    """ Context to time a stage in, which does nothing when profile is None """
+    return contextlib.nullcontext() if profile is None else profile.stage(name, ticker)
+
+class Profile:
+    """ Wall time of each stage of a run, and the change in the resident memory of the process it ran in.
+        Stages done for each ticker (preprocess, forecast, ta_features, lags, concat) are recorded with the ticker, by the
+        pool worker that did them, and sent back to the parent with the ticker's results. Their totals are summed over the
+        workers, so they add up to more than the wall time of the run when the workers run in parallel. """
+    def __init__(self, cprofile=None):
+        """ cprofile: path prefix of cProfile stats files, one for this process and one for each pool worker, or None """
+        self.records, self.cprofile, self.pid = [ ], cprofile, os.getpid()
+        self.time_start = perf_counter()
+        self.profiler = None
+        if cprofile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name, ticker=None):
+        time_start, memory = perf_counter(), rss()
+        try:
+            yield
+        finally:
+            now = rss()
+            self.records.append({   'stage': name, 'ticker': ticker, 'pid': os.getpid(), 'seconds': perf_counter() - time_start,
+                                    'rss_mb': now / MB, 'rss_change_mb': (now - memory) / MB })
+
+    def since(self, mark):
+        """ Records added since there were mark of them, taken out of this profile, for a worker to send to the parent """
+        records = self.records[mark:]
+        del self.records[mark:]
+        return records
+
+    def worker(self):
+        """ Called in a forked pool worker: profile it separately from the parent it was forked from,
+            and dump its stats when it exits """
+        if not self.cprofile or self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.profiler.disable() # the parent's, inherited through fork
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        multiprocessing.util.Finalize(None, self.dump, args=(f'{self.cprofile}.worker-{self.pid}',), exitpriority=10)
+
+    def dump(self, path):
+        self.profiler.disable()
+        self.profiler.dump_stats(path)
+
+    def summary(self):
+        """ Number of runs, total, mean & max wall time, and the largest memory change and resident memory of each stage, slowest first """
+        records = pd.DataFrame(self.records, columns=[ 'stage', 'ticker', 'pid', 'seconds', 'rss_mb', 'rss_change_mb' ])
+        g = records.groupby('stage', sort=False)
+        summary = pd.DataFrame({ 'runs': g.size(), 'tickers': g['ticker'].nunique(), 'seconds': g['seconds'].sum(),
+                                 'mean_seconds': g['seconds'].mean(), 'max_seconds': g['seconds'].max(),
+                                 'max_rss_change_mb': g['rss_change_mb'].max(), 'peak_rss_mb': g['rss_mb'].max() })
+        return summary.sort_values('seconds', ascending=False)
+
+    def tickers(self):
+        """ Wall time of each per-ticker stage, by ticker """
+        records = pd.DataFrame(self.records, columns=[ 'stage', 'ticker', 'seconds' ]).dropna(subset=[ 'ticker' ])
+        return records.pivot_table(index='ticker', columns='stage', values='seconds', aggfunc='sum', sort=True)
+
+    def save(self, prefix, **metadata):
+        """ Write the report: prefix.json with the per-stage summary and per-ticker timings, prefix.csv with every record,
+            and with cProfile, prefix.prof with the stats of this process and all of its pool workers merged,
+            which pstats, snakeviz and the like read """
+        summary, tickers = self.summary(), self.tickers()
+        report = {  **metadata, 'seconds': perf_counter() - self.time_start, 'peak_rss_mb': rss() / MB,
+                    'stages': summary.reset_index().to_dict(orient='records'),
+                    'tickers': { t: row.dropna().to_dict() for t, row in tickers.iterrows() } }
+        with open(prefix + '.json', 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+        pd.DataFrame(self.records).to_csv(prefix + '.csv', index=False)
+
+        if self.profiler is not None:
+            self.dump(prefix + '.prof')
+            workers = sorted(glob.glob(f'{self.cprofile}.worker-*'))
+            stats = pstats.Stats(prefix + '.prof')
+            for path in workers:
+                stats.add(path)
+                os.remove(path)
+            stats.dump_stats(prefix + '.prof')
+        return summary
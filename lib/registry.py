@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Registry of the trained models, versioned by STAMP and score, with the current version of each STAMP linked to
+
+import glob, json, os, threading
+import datetime
+from joblib import dump, load
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+MODELS_DIR = BASE_DIR + '/../models'
+
+class Registry:
+    """ Models are saved as model_<STAMP>_<score>.bin with their metadata next to them in a .json file,
+        and model_<STAMP>.bin links to the current version. Loaded models are kept in memory until their file changes. """
+    def __init__(self, directory=MODELS_DIR):
+        self.directory = directory
+        self.cache = { } # real path: (modification time, model)
+        self.lock = threading.Lock()
+
+    def path(self, stamp, score=None):
+        return f'{self.directory}/model_{stamp}.bin' if score is None else f'{self.directory}/model_{stamp}_{score}.bin'
+
+    def save(self, model, stamp, score, features, **metadata):
+        """ Save a new version of the stamp's model and make it the current one """
+        new_model_file = self.path(stamp, score)
+        dump(model, new_model_file, compress=True)
+        metadata = { 'stamp': stamp, 'score': score, 'features': [ str(f) for f in features ],
+                     'created': datetime.datetime.now().isoformat(timespec='seconds'), **metadata }
+        with open(new_model_file[:-len('.bin')] + '.json', 'w') as f:
+            json.dump(metadata, f, indent=1, default=str)
+
+        link = self.path(stamp)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.basename(new_model_file), link)
+        return new_model_file
+
+    def versions(self, stamp=None):
+        """ Metadata of the saved versions, of all stamps or only the given one, best score first. Versions saved without
+            metadata only have their stamp and score. """
+        versions = [ ]
+        for model_file in glob.glob(f'{self.directory}/model_*_*.bin'):
+            name = os.path.basename(model_file)[len('model_'):-len('.bin')]
+            version_stamp, _, score = name.rpartition('_')
+            if stamp is not None and version_stamp != stamp:
+                continue
+            metadata_file = model_file[:-len('.bin')] + '.json'
+            if os.path.isfile(metadata_file):
+                with open(metadata_file) as f:
+                    metadata = json.load(f)
+            else:
+                metadata = { 'stamp': version_stamp, 'score': score }
+            metadata['current'] = os.path.realpath(self.path(version_stamp)) == os.path.realpath(model_file)
+            versions.append(metadata)
+        return sorted(versions, key=lambda v: (v['stamp'], -float(v['score'])))
+
+    def metadata(self, stamp, score=None):
+        """ Metadata of the current version of the stamp's model, or of the given version. None if it was saved without. """
+        metadata_file = os.path.realpath(self.path(stamp, score))[:-len('.bin')] + '.json'
+        if not os.path.isfile(metadata_file):
+            return None
+        with open(metadata_file) as f:
+            return json.load(f)
+
+    def features(self, stamp, score=None):
+        """ Names of the features the model was trained on, in order, from its metadata or the model itself. None if neither has them. """
+        metadata = self.metadata(stamp, score)
+        if metadata is not None:
+            return metadata['features']
+        names = getattr(self.load(stamp, score), 'feature_names_in_', None)
+        return None if names is None else [ str(f) for f in names ]
+
+    def check_features(self, stamp, columns, score=None):
+        """ Raise if the model wasn't trained on the given columns. They may come in a different order. """
+        features = self.features(stamp, score)
+        if features is None:
+            return
+        missing, extra = [ f for f in features if f not in set(columns) ], [ c for c in columns if c not in set(features) ]
+        if missing or extra:
+            raise ValueError(f'the features of model {stamp} do not match the dataset; missing from the dataset: {missing}, not in the model: {extra}')
+
+    def load(self, stamp, score=None):
+        """ The current version of the stamp's model, or the given version, from memory unless its file has changed since it was loaded """
+        model_file = os.path.realpath(self.path(stamp, score))
+        modified = os.path.getmtime(model_file)
+        with self.lock:
+            cached = self.cache.get(model_file)
+            if cached is None or cached[0] != modified:
+                self.cache[model_file] = (modified, load(model_file))
+            return self.cache[model_file][1]
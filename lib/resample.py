@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Weekly and monthly bars aggregated straight from the daily bars, in one pass over NumPy arrays
+
+import numpy as np
+import pandas as pd
+
+DAY = np.timedelta64(1, 'D')
+
+def offset(rule):
+    """ The rule's pandas offset if aggregate() can make its bars: weekly on any day (W, W-FRI...) or monthly (M, ME). None otherwise. """
+    if rule == 'no':
+        return None
+    try:
+        o = pd.tseries.frequencies.to_offset(rule)
+    except ValueError:
+        return None
+    if o.n == 1 and ((isinstance(o, pd.offsets.Week) and o.weekday is not None) or type(o) is pd.offsets.MonthEnd):
+        return o
+    return None
+
+def labels(days, o):
+    """ Last day of the bucket each day falls in, which is what pandas labels the bucket with """
+    if isinstance(o, pd.offsets.Week):
+        weekday = (days.astype('int64') + 3) % 7 # 1970-01-01 was a Thursday
+        return days + ((o.weekday - weekday) % 7) * DAY
+    return (days.astype('datetime64[M]') + 1).astype('datetime64[D]') - DAY
+
+def starts(labels, o):
+    """ First day of the buckets with the given labels """
+    if isinstance(o, pd.offsets.Week):
+        return labels - 6 * DAY
+    return labels.astype('datetime64[M]').astype('datetime64[D]')
+
+def aggregate(d, rule):
+    """ Bars of the daily bars in d over the rule's buckets, the same as padding d to every calendar day with
+        d.resample('D').ffill(), zeroing the weekend volumes, then taking each bucket's first open, highest high, lowest low,
+        last close and total volume, and keeping the buckets whose label falls on one of the padded days.
+        Other columns are taken on the label day, and buckets with anything missing are dropped.
+        Each padded day repeats the last bar before it, so a bucket is made of the spans between its first day and
+        the bars in it, each of which repeats one bar. The volume of a span is that bar's volume times its number of weekdays,
+        which is exact as long as volumes are whole numbers. """
+    o = offset(rule)
+    days = d.index.values.astype('datetime64[D]')
+    if len(d) == 0:
+        return d.iloc[:0]
+    first, last = days[0], days[-1]
+
+    # buckets from the one the first day falls in, up to the last one that ends by the last day
+    bucket_labels = labels(days[:1], o)[0]
+    if isinstance(o, pd.offsets.Week):
+        bucket_labels = np.arange(bucket_labels, last + DAY, 7 * DAY)
+    else:
+        bucket_labels = labels(np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1).astype('datetime64[D]'), o)
+        bucket_labels = bucket_labels[bucket_labels <= last]
+    if len(bucket_labels) == 0:
+        return d.iloc[:0]
+    bucket_starts = np.maximum(starts(bucket_labels, o), first)
+
+    # spans of days that repeat one bar and are within one bucket
+    end = bucket_labels[-1] + DAY
+    span_starts = np.union1d(days[days < end], bucket_starts)
+    span_ends = np.append(span_starts[1:], end)
+    bars = np.searchsorted(days, span_starts, 'right') - 1
+    first_spans = np.searchsorted(span_starts, bucket_starts)
+    weekdays = np.busday_count(span_starts, span_ends)
+
+    def first_valid(values):
+        position = np.where(np.isnan(values), len(values), np.arange(len(values)))
+        position = np.minimum.reduceat(position, first_spans)
+        return np.where(position < len(values), values[np.minimum(position, len(values) - 1)], np.nan)
+
+    def last_valid(values):
+        position = np.where(np.isnan(values), -1, np.arange(len(values)))
+        position = np.maximum.reduceat(position, first_spans)
+        return np.where(position >= 0, values[position], np.nan)
+
+    label_bars = bars[np.append(first_spans[1:], len(span_starts)) - 1] # the bar the label day repeats
+    columns = { }
+    for c in d.columns:
+        if c in ('open', 'high', 'low', 'close', 'volume'):
+            values = d[c].values.astype('float64')[bars]
+            if c == 'open':
+                columns[c] = first_valid(values)
+            elif c == 'high':
+                columns[c] = np.fmax.reduceat(values, first_spans)
+            elif c == 'low':
+                columns[c] = np.fmin.reduceat(values, first_spans)
+            elif c == 'close':
+                columns[c] = last_valid(values)
+            else:
+                columns[c] = np.add.reduceat(np.where(np.isnan(values), 0.0, values) * weekdays, first_spans)
+        else:
+            columns[c] = d[c].values[label_bars]
+    index = pd.DatetimeIndex(bucket_labels.astype(d.index.values.dtype), name=d.index.name)
+    return pd.DataFrame(columns, index=index, columns=d.columns).dropna()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Budget-aware hyperparameter search for the voting ensemble: successive halving, with LightGBM early stopping
+
+import numpy as np
+import hashlib, json, math, os, random
+from time import perf_counter
+import lightgbm
+from lightgbm import LGBMRegressor
+from sklearn.ensemble import RandomForestRegressor
+from lib.evaluation import alpha
+
+# the full LGB + RF space, in the VotingRegressor's parameter names
+SEARCH_SPACE = {
+    'gb__boosting_type': [ 'gbdt', 'goss' ],
+    'gb__num_leaves': [ 15, 23, 31, 47, 63 ],
+    'gb__learning_rate': [ .05, .06, .07, .08, .09, .10 ],
+    'gb__min_child_samples': [ 19, 20, 21, 22, 23 ],
+    'gb__min_child_weight': [ 0.0001, 0.001, 0.01 ],
+    'gb__colsample_bytree': [ .45, .52, .60, .69, .80, .92 ],
+    'gb__reg_alpha':  [ 0.001, 0.01, 0.1 ],
+    'gb__reg_lambda': [ 0.001, 0.01, 0.1 ],
+    'rf__max_features': [ .69, .80, .92 ],
+    'rf__min_samples_leaf': [ 20, 21, 22 ],
+    'rf__min_samples_split': [ 2, 3 ],
+    'rf__max_depth': [ 15, 16, 17, 18, 19, 20, 21, 22 ],
+    'weights':  [ [1/2, 1/2], [2/3, 1/3], [3/4, 1/4] ],
+}
+
+MAX_ROUNDS = 5000 # boosting rounds are capped by early stopping instead
+EARLY_STOPPING_ROUNDS = 50
+MIN_SAMPLES = 1000 # training samples of the smallest rung
+MIN_TREES = 10 # random forest trees of the smallest rung
+HASH_ROWS = 10000 # rows of the data hashed at a time for the fingerprint
+
+class SuccessiveHalving:
+    """ Evaluates many sampled candidates on a small, recent part of the training set, then keeps the best 1/eta of them
+        for the next rung, which trains on eta times as much data, until one is left, trained on all of it.
+        LightGBM stops boosting once the validation error stops improving, and the forest grows trees in proportion to the data.
+        Each evaluation is appended to a JSON lines log as soon as it's done, with a fingerprint of the search settings and the data.
+        The ones found there with the same fingerprint are not repeated, so that an interrupted search resumes where it left off,
+        but a search on another split, refreshed data or with other base parameters starts over. """
+    def __init__(self, base_params, space=SEARCH_SPACE, candidates=81, eta=3, seed=6, log=None, verbose=1):
+        """ base_params: { 'gb': LGBMRegressor parameters, 'rf': RandomForestRegressor parameters, 'weights': [ gb, rf ] } """
+        self.base_params, self.space, self.eta, self.seed, self.log, self.verbose = base_params, space, eta, seed, log, verbose
+        self.candidates = self.sample(candidates)
+        self.rungs = 1 + int(math.floor(math.log(len(self.candidates), eta) + 1e-9))
+        self.done = { }
+
+    @staticmethod
+    def key(params):
+        return json.dumps(params, sort_keys=True)
+
+    def fingerprint(self, *arrays):
+        """ Digest of the search settings and of the data arrays, hashed a chunk of rows at a time so that none are copied whole """
+        settings = { 'base_params': self.base_params, 'space': self.space, 'candidates': len(self.candidates), 'eta': self.eta, 'seed': self.seed }
+        digest = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode())
+        for a in arrays:
+            digest.update(f'{a.shape} {a.dtype}'.encode())
+            for start in range(0, len(a), HASH_ROWS):
+                digest.update(np.ascontiguousarray(a[start:(start + HASH_ROWS)]))
+        return digest.hexdigest()
+
+    def resume(self, fingerprint):
+        """ Evaluations in the log with the given fingerprint, by candidate and rung """
+        done = { }
+        if self.log is not None and os.path.isfile(self.log):
+            with open(self.log) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if record.get('fingerprint') == fingerprint:
+                            done[(self.key(record['params']), record['rung'])] = record
+        return done
+
+    def sample(self, n):
+        """ n distinct candidates drawn from the space, the same ones for the same seed. All of them if the space is smaller. """
+        size = math.prod(len(v) for v in self.space.values())
+        rng = random.Random(self.seed)
+        candidates, keys = [ ], set()
+        while len(candidates) < min(n, size):
+            params = { p: rng.choice(values) for p, values in self.space.items() }
+            if self.key(params) not in keys:
+                keys.add(self.key(params))
+                candidates.append(params)
+        return candidates
+
+    def components(self, params):
+        gb = { **self.base_params['gb'], **{ p[4:]: v for p, v in params.items() if p.startswith('gb__') } }
+        rf = { **self.base_params['rf'], **{ p[4:]: v for p, v in params.items() if p.startswith('rf__') } }
+        return gb, rf, params.get('weights', self.base_params['weights'])
+
+    def evaluate(self, params, fraction, X_train, y_train, X_val, y_val):
+        """ alpha on the validation set of the candidate trained on the most recent fraction of the training set,
+            and the number of boosting rounds it stopped at """
+        gb_params, rf_params, weights = self.components(params)
+        n = len(X_train)
+        rows = slice(n - min(max(int(n * fraction), MIN_SAMPLES), n), n)
+        gb = LGBMRegressor(**{ **gb_params, 'n_estimators': MAX_ROUNDS })
+        gb.fit( X_train[rows], y_train[rows], eval_set=[ (X_val, y_val) ], eval_metric='l1',
+                callbacks=[ lightgbm.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False) ])
+        rf = RandomForestRegressor(**{ **rf_params, 'n_estimators': max(MIN_TREES, int(rf_params.get('n_estimators', 100) * fraction)) })
+        rf.fit(X_train[rows], y_train[rows])
+        predictions = np.average([ gb.predict(X_val), rf.predict(X_val) ], axis=0, weights=weights)
+        return alpha(y_val, predictions), int(gb.best_iteration_ or MAX_ROUNDS)
+
+    def run(self, X_train, y_train, X_val, y_val):
+        """ The best candidate's parameters, with the boosting rounds it stopped at on the last rung, and its alpha """
+        X_train, y_train, X_val, y_val = [ np.asarray(a) for a in (X_train, y_train, X_val, y_val) ]
+        fingerprint = self.fingerprint(X_train, y_train, X_val, y_val)
+        self.done = self.resume(fingerprint)
+        if self.verbose > 0 and self.done:
+            print('resuming the search with', len(self.done), 'evaluations from', self.log)
+        candidates = self.candidates
+        for rung in range(self.rungs):
+            fraction = self.eta ** (rung - (self.rungs - 1))
+            time_start = perf_counter()
+            records = [ ]
+            for params in candidates:
+                record = self.done.get((self.key(params), rung))
+                if record is None:
+                    time_start_candidate = perf_counter()
+                    score, rounds = self.evaluate(params, fraction, X_train, y_train, X_val, y_val)
+                    record = { 'rung': rung, 'fraction': fraction, 'alpha': score, 'rounds': rounds, 'params': params,
+                               'seconds': round(perf_counter() - time_start_candidate, 1), 'fingerprint': fingerprint }
+                    if self.log is not None:
+                        with open(self.log, 'a') as f:
+                            f.write(json.dumps(record) + '\n')
+                records.append(record)
+            records.sort(key=lambda r: r['alpha'] if np.isfinite(r['alpha']) else -np.inf, reverse=True)
+            if self.verbose > 0:
+                print(  f'rung {rung + 1}/{self.rungs}: {len(records)} candidates on {fraction:.0%} of the training set in',
+                        round(perf_counter() - time_start), 'seconds, best alpha:', round(records[0]['alpha'], 2))
+            candidates = [ r['params'] for r in records[:max(1, len(records) // self.eta)] ]
+        best = records[0]
+        return { **best['params'], 'gb__n_estimators': best['rounds'] }, best['alpha']
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Shared-memory frame that forked workers write their rows into, laid out in (date, ticker) order
+
+import numpy as np
+import pandas as pd
+import mmap
+from pandas.tseries.frequencies import to_offset
+
+CHUNK_ROWS = 65536 # rows moved at a time when compacting
+
+class DateSlots:
+    """ Reserves one row per ticker for each date on the resampling grid that the ticker's data spans, in (date, ticker) order,
+        so that rows can be written in their final order as they come, by any worker. Tickers are given in the order they sort in. """
+    def __init__(self, spans, rule):
+        """ spans: { position of the ticker: (first date, last date) } """
+        offset = to_offset(rule)
+        self.grid = pd.date_range(min(s[0] for s in spans.values()) - offset, max(s[1] for s in spans.values()) + 2 * offset, freq=rule, name='date')
+        counts = np.zeros(len(self.grid), dtype='int64')
+        ranks = { }
+        for position in sorted(spans):
+            first, last = spans[position]
+            # a bin either side, as labels can fall on either side of the dates they aggregate, depending on the rule
+            start = max(self.grid.searchsorted(first) - 1, 0)
+            end = min(self.grid.searchsorted(last) + 1, len(self.grid) - 1)
+            ranks[position] = (start, counts[start:(end + 1)].copy()) # position among the tickers with a slot on each date
+            counts[start:(end + 1)] += 1
+
+        starts = np.cumsum(counts) - counts
+        self.size = int(counts.sum())
+        self.position, self.bin = np.empty(self.size, dtype='int32'), np.empty(self.size, dtype='int32')
+        self.slots = { }
+        for position, (start, rank) in ranks.items():
+            rows = starts[start:(start + len(rank))] + rank
+            self.position[rows], self.bin[rows] = position, np.arange(start, start + len(rank))
+            self.slots[position] = (start, rows)
+
+    def rows(self, position, dates):
+        """ Rows reserved for the ticker on the given dates, or None if they don't all have one """
+        if position not in self.slots:
+            return None
+        start, rows = self.slots[position]
+        bins = self.grid.get_indexer(dates) - start
+        if (bins < 0).any() or (bins >= len(rows)).any() or len(np.unique(bins)) < len(bins):
+            return None
+        return rows[bins]
+
+class SharedFrame:
+    """ Numeric columns of a frame in anonymous shared memory, one matrix per dtype. It's allocated before the workers are forked,
+        so that they write their rows into it directly instead of pickling them back to the parent.
+        Memory is only committed for the pages that get written to. """
+    def __init__(self, dtypes, size):
+        """ dtypes: { column: dtype } for the numeric columns, size: number of rows reserved """
+        self.size = size
+        self.groups, self.buffers, self.matrices, self.locations = { }, { }, { }, { }
+        for c, t in dtypes.items():
+            t = np.dtype(t)
+            self.locations[c] = (t, len(self.groups.setdefault(t, [])))
+            self.groups[t].append(c)
+        for t, columns in self.groups.items():
+            self.buffers[t] = mmap.mmap(-1, max(size * len(columns) * t.itemsize, 1)) # anonymous maps are shared with forked children
+            self.matrices[t] = np.frombuffer(self.buffers[t], dtype=t, count=size * len(columns)).reshape(size, len(columns))
+        self.used_buffer = mmap.mmap(-1, max(size, 1))
+        self.used = np.frombuffer(self.used_buffer, dtype='uint8', count=size)
+        self.rows = 0
+
+    def write(self, rows, frame):
+        for t, columns in self.groups.items():
+            self.matrices[t][rows] = frame[columns].to_numpy(dtype=t)
+        self.used[rows] = 1
+
+    def compact(self):
+        """ Move the rows written to the front, keeping their order, release the memory behind them,
+            and return the reserved positions they were written to """
+        written = np.flatnonzero(self.used)
+        for matrix in self.matrices.values():
+            # rows only ever move towards the front, so each chunk can be read as a whole before it's written
+            for start in range(0, len(written), CHUNK_ROWS):
+                chunk = written[start:(start + CHUNK_ROWS)]
+                matrix[start:(start + len(chunk))] = matrix[chunk]
+        self.rows = len(written)
+
+        for t, buffer in self.buffers.items():
+            end = -(-(self.rows * self.matrices[t].shape[1] * t.itemsize) // mmap.PAGESIZE) * mmap.PAGESIZE
+            if end < len(buffer):
+                try:
+                    buffer.madvise(mmap.MADV_REMOVE, end, len(buffer) - end)
+                except (AttributeError, OSError): # not available on this platform; the memory is released with the frame
+                    pass
+        return written
+
+    def column(self, name):
+        t, j = self.locations[name]
+        return self.matrices[t][:self.rows, j]
+
+    def frame(self, columns, index, extra):
+        """ DataFrame of the compacted rows, with the given columns in order, taken from the shared matrices or extra, without copying """
+        return pd.DataFrame({ c: extra[c] if c in extra else self.column(c) for c in columns }, index=index, copy=False)
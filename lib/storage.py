@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Storage backends for daily price data: the MSSQL table, or a local partitioned Arrow store
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+from pyarrow.fs import LocalFileSystem
+import os, re, glob, urllib.parse
+from datetime import date
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+STORE_DIR = BASE_DIR + '/../data/store'
+
+TABLE = '[stox].[stocks].[daily]'
+COLUMNS = [ 'date', 'market', 'ticker', 'open', 'high', 'low', 'close', 'volume', 'dividend', 'split' ]
+PRICE_COLUMNS = COLUMNS[3:]
+PARTITION_SCHEMA = pa.schema([ ('market', pa.string()), ('ticker', pa.string()) ])
+CHUNK_SIZE = 250000 # rows per chunk when streaming the bulk query
+
+DATE_CLAUSE = re.compile(r"^\s*date\s*(<=|>=|<|>|=)\s*'(\d{4}-\d{2}-\d{2})'\s*$", re.IGNORECASE)
+
+def partition(chunks):
+    """ Partition a stream of data chunks by (market, ticker), each partition sorted by date """
+    partitions = { }
+    for chunk in chunks:
+        # a ticker may straddle two chunks, so collect its pieces and concatenate them at the end
+        for key, rows in chunk.groupby(['market', 'ticker'], sort=False):
+            partitions.setdefault(key, []).append(rows)
+
+    data = { }
+    for key, pieces in partitions.items():
+        d = pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+        data[key] = d if d.index.is_monotonic_increasing else d.sort_index()
+    return data
+
+class SQLBackend:
+    """ The [stocks].[daily] table on the MSSQL server """
+    name = 'sql'
+
+    def read_daily(self, markets, predicate):
+        """ Stream the rows for the given markets matching the predicate, in chunks indexed by date """
+        from lib.db import db_connection
+        dbconn = db_connection()
+        query = f"""
+                SELECT * FROM {TABLE}
+                WHERE {predicate}
+                    AND market IN ({','.join(f"'{m}'" for m in sorted(markets))})
+                ORDER BY market ASC, ticker ASC, date ASC
+                """
+        try:
+            yield from pd.read_sql_query(   query,
+                                            dbconn,
+                                            index_col=['date'],
+                                            chunksize=CHUNK_SIZE)
+        finally:
+            dbconn.close()
+
+    def _distinct(self, where):
+        from lib.db import db_connection
+        dbconn = db_connection()
+        tickers =   pd.read_sql_query(
+                        f"""
+                        SELECT DISTINCT market, ticker FROM {TABLE}
+                        WHERE {where}
+                        """,
+                        dbconn
+                    )
+        dbconn.close()
+
+        return [ (mt[1][0], mt[1][1],) for mt in tickers.iterrows() ]
+
+    def tickers(self, markets=None):
+        where = "SUBSTRING(ticker,1,1) <> '^'"
+        if markets is not None:
+            where += " AND market IN(" + ','.join(f"'{m}'" for m in markets) + ")"
+        return self._distinct(where)
+
+    def indices(self):
+        return self._distinct("SUBSTRING(ticker,1,1) = '^'")
+
+    def write_table(self, frame, name, schema):
+        from lib.db import db_engine
+        frame.to_sql(name, if_exists='replace', schema=schema, index=False, con=db_engine())
+
+class ArrowStore:
+    """ Local columnar store, one Arrow IPC file per ticker under market=<market>/ticker=<ticker>/ partitions.
+        Files are read through memory maps, with partition pruning on market and the date range pushed down into the scan. """
+    name = 'arrow'
+
+    def __init__(self, directory=None):
+        self.directory = os.path.realpath(directory or STORE_DIR)
+
+    def dataset(self):
+        return ds.dataset(  self.directory, format='ipc',
+                            partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'),
+                            filesystem=LocalFileSystem(use_mmap=True))
+
+    @staticmethod
+    def date_filter(predicate):
+        """ Translate a SQL-style date range predicate, e.g. "date >= '2016-01-01' AND date < '2020-01-01'", into a dataset filter """
+        expression = None
+        for clause in re.split(r'\s+AND\s+', predicate, flags=re.IGNORECASE):
+            match = DATE_CLAUSE.match(clause)
+            if match is None:
+                raise ValueError(f'ArrowStore only supports date range predicates, got: {clause}')
+            op, value = match.groups()
+            field, value = ds.field('date'), date.fromisoformat(value)
+            e = {   '<': field < value, '<=': field <= value, '>': field > value,
+                    '>=': field >= value, '=': field == value }[op]
+            expression = e if expression is None else expression & e
+        return expression
+
+    def read_daily(self, markets, predicate):
+        """ Stream the rows for the given markets matching the predicate, in batches indexed by date """
+        dataset = self.dataset() if os.path.isdir(self.directory) else None
+        if dataset is None or len(dataset.files) == 0: # e.g. data/store in a fresh checkout, with only its .gitkeep
+            raise FileNotFoundError(f'there is no data in the Arrow store at {self.directory}. Mirror the SQL table into it with util/sql2store.py')
+        scan_filter = ds.field('market').isin(sorted(markets)) & self.date_filter(predicate)
+        for batch in dataset.to_batches(columns=COLUMNS, filter=scan_filter):
+            if batch.num_rows > 0:
+                d = batch.to_pandas(date_as_object=False).set_index('date')
+                d.index = d.index.as_unit('ns') # date32 comes back in ms, and the SQL backend's dates are in ns
+                yield d
+
+    def _partitions(self):
+        if not os.path.isdir(self.directory):
+            return []
+        keys = [ ds.get_partition_keys(f.partition_expression) for f in self.dataset().get_fragments() ]
+        return sorted(set( (k['market'], k['ticker'],) for k in keys ))
+
+    def tickers(self, markets=None):
+        return [ t for t in self._partitions() if not t[1].startswith('^') and (markets is None or t[0] in markets) ]
+
+    def indices(self):
+        return [ t for t in self._partitions() if t[1].startswith('^') ]
+
+    def write_daily(self, market, ticker, data):
+        """ Replace the stored partition of a single ticker with the given data, indexed by date """
+        path = '/'.join([   self.directory,
+                            'market=' + urllib.parse.quote(market, safe=''),
+                            'ticker=' + urllib.parse.quote(ticker, safe='') ])
+        os.makedirs(path, exist_ok=True)
+        for old_file in glob.glob(path + '/*.arrow'):
+            os.remove(old_file)
+
+        d = data.sort_index()
+        table = pa.table({  'date': pa.array(pd.to_datetime(d.index).date, type=pa.date32()),
+                            **{ c: pa.array(d[c].to_numpy(dtype='float64'), type=pa.float64()) for c in PRICE_COLUMNS } })
+        feather.write_feather(table, path + '/part-0.arrow', compression='uncompressed') # uncompressed, so that it can be memory-mapped
+
+    def write_table(self, frame, name, schema):
+        path = f'{self.directory}/_{schema}' # underscore-prefixed directories are ignored by dataset discovery
+        os.makedirs(path, exist_ok=True)
+        feather.write_feather(frame, f'{path}/{name}.arrow')
+
+BACKENDS = { 'sql': SQLBackend, 'arrow': ArrowStore }
+DEFAULT_BACKEND = os.environ.get('STOX_BACKEND', 'sql')
+
+def use(name, directory=None):
+    """ Set the backend to be used by default, e.g. from a command line switch, and the directory of the Arrow store if given """
+    global DEFAULT_BACKEND, STORE_DIR
+    if name not in BACKENDS:
+        raise ValueError(f'unknown storage backend {name}, expected one of: {", ".join(BACKENDS)}')
+    DEFAULT_BACKEND = name
+    if directory is not None:
+        STORE_DIR = directory
+
+def backend(name=None):
+    return BACKENDS[name or DEFAULT_BACKEND]()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Synthetic daily price panels of a market index and its tickers, generated a block of tickers at a time with NumPy
+
+import numpy as np
+import pandas as pd
+
+KINDS = ('market', 'easy', 'hard')
+END = '2020-12-31'
+SEED = 6
+BLOCK = 500 # tickers generated at a time, which bounds the memory taken by large panels
+YEAR = 252 # trading days
+HOLIDAYS = 9 / 261 # of the weekdays
+MISSING = 0.005 # chance of a ticker's bar being missing from the data on any day
+NO_TRADES = 0.01 # chance of a ticker not trading on any day: zero volume and a flat bar
+LISTED_LATER, DELISTED, REUSED = 0.3, 0.1, 0.02 # shares of the tickers that list after the first day, delist before the last,
+GAP = 2 * YEAR # and whose code is reused by another company after a gap of GAP days, longer than the gap detection's year
+
+def calendar(rng, days, end=END):
+    """ The last number of days trading days up to end: weekdays, less about 9 random holidays a year """
+    weekdays = pd.bdate_range(end=end, periods=int(days / (1 - HOLIDAYS)) + 20, name='date')
+    trading = weekdays[rng.random(len(weekdays)) >= HOLIDAYS]
+    return trading[-days:]
+
+def student_t(rng, shape, df=4):
+    """ Fat-tailed noise with unit variance """
+    return rng.standard_t(df, shape) / np.sqrt(df / (df - 2))
+
+def volatility(rng, days, width, persistence=0.98, spread=0.3):
+    """ (days x width) volatility multipliers with a mean of 1 that cluster in time, the exponential of an AR(1) process """
+    shocks = rng.normal(0, spread * np.sqrt(1 - persistence ** 2), (days, width))
+    log_vol = np.empty_like(shocks)
+    log_vol[0] = rng.normal(0, spread, width)
+    for t in range(1, days):
+        log_vol[t] = persistence * log_vol[t - 1] + shocks[t]
+    return np.exp(log_vol - spread ** 2 / 2)
+
+def bars(rng, close, sigma, base_volume):
+    """ Opens, highs, lows and whole volumes around the (days x width) closes, with daily return volatility sigma """
+    previous = np.vstack([ close[:1], close[:-1] ])
+    open_ = previous * np.exp(rng.normal(0, 0.3, close.shape) * sigma)
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.5, close.shape)) * sigma)
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.5, close.shape)) * sigma)
+    moves = np.abs(np.log(close / previous)) / sigma # volume rises with the size of the move
+    volume = np.round(base_volume * rng.lognormal(0, 0.4, close.shape) * (1 + 0.3 * moves))
+    return open_, high, low, volume
+
+def index_block(rng, days):
+    """ Close returns and OHLCV of a market index: drift and clustered, fat-tailed noise """
+    sigma = 0.01 * volatility(rng, days, 1)
+    returns = 0.0003 + sigma * student_t(rng, (days, 1))
+    close = 1000 * np.exp(np.cumsum(returns, axis=0))
+    open_, high, low, volume = bars(rng, close, sigma, np.full(1, 5e8))
+    return returns, (open_, high, low, close, volume)
+
+def market_block(rng, days, width, index_returns):
+    """ OHLCV of width tickers that follow the index by their betas, with clustered, fat-tailed idiosyncratic noise,
+        and the (days x width) mask of their bars that are missing from the data """
+    beta = rng.uniform(0.4, 1.6, width)
+    idiosyncratic = rng.lognormal(np.log(0.018), 0.4, width) * volatility(rng, days, width)
+    returns = beta * index_returns + idiosyncratic * student_t(rng, (days, width)) - idiosyncratic ** 2 / 2
+    close = rng.lognormal(np.log(10), 1.5, width) * np.exp(np.cumsum(returns, axis=0))
+    sigma = np.sqrt((beta * 0.01) ** 2 + idiosyncratic ** 2)
+
+    # listings, delistings, codes reused after a gap, and missing bars
+    t = np.arange(days)[:, None]
+    start = np.where(rng.random(width) < LISTED_LATER, rng.integers(0, max(days - YEAR, 1), width), 0)
+    end = np.where(rng.random(width) < DELISTED, rng.integers(np.minimum(start + YEAR, days - 1), days), days)
+    reused = (rng.random(width) < REUSED) & (end - start > GAP + 2 * YEAR)
+    gap = start + YEAR + (rng.random(width) * np.maximum(end - start - GAP - 2 * YEAR, 0)).astype(int)
+    close = np.where(reused & (t >= gap + GAP), close * rng.lognormal(0, 1, width), close)
+    missing = (t < start) | (t >= end) | (reused & (t >= gap) & (t < gap + GAP)) | (rng.random((days, width)) < MISSING)
+
+    open_, high, low, volume = bars(rng, close, sigma, rng.lognormal(np.log(2e5), 1.5, width))
+    no_trades = rng.random((days, width)) < NO_TRADES
+    open_, high, low = ( np.where(no_trades, close, x) for x in (open_, high, low) )
+    volume[no_trades] = 0
+    return (open_, high, low, close, volume), missing
+
+def easy_block(rng, days, width):
+    """ The monotonous, very predictable series of lib/old/mock.py, one for each ticker at a random scale """
+    i = np.arange(days)[:, None]
+    scale = rng.lognormal(0, 1, width)
+    open_ = (i * i + 1) / 1000 * scale
+    close = open_ * 1.01
+    return (open_, open_ * 1.005, open_ * 0.995, close, np.floor(close * 1000)), np.zeros((days, width), dtype=bool)
+
+def hard_block(rng, days, width):
+    """ The gaussian, unpredictable series of lib/old/mock.py: each day's bar is drawn independently around 1 """
+    open_ = rng.normal(1, 0.04, (days, width))
+    close = open_ * rng.normal(1, 0.04, (days, width))
+    up = close > open_
+    high = np.where(up, close, open_) * rng.normal(1.04, 0.039, (days, width))
+    low = np.where(up, open_, close) * rng.normal(0.96, 0.039, (days, width))
+    volume = rng.integers(100, 1000000, (days, width)).astype('float64')
+    return (open_, high, low, close, volume), np.zeros((days, width), dtype=bool)
+
+def frames(market, tickers, days, end=END, kind='market', seed=SEED):
+    """ Yield ((market, ticker), frame) for the market's index, ^<market>, and then for the given number of tickers,
+        with the daily bars of the last number of days trading days up to end, indexed by date.
+        The same arguments give the same panel. """
+    if kind not in KINDS:
+        raise ValueError(f'unknown kind of synthetic data {kind}, expected one of: {", ".join(KINDS)}')
+    rng = np.random.default_rng(seed)
+    dates = calendar(rng, days, end)
+
+    def block_frames(codes, block, missing):
+        for j, code in enumerate(codes):
+            rows = ~missing[:, j]
+            columns = { c: x[rows, j] for c, x in zip(('open', 'high', 'low', 'close', 'volume'), block) }
+            yield (market, code), pd.DataFrame({ **columns, 'dividend': 0.0, 'split': 0.0 }, index=dates[rows])
+
+    if kind == 'market':
+        index_returns, block = index_block(rng, days)
+    else:
+        block = (easy_block if kind == 'easy' else hard_block)(rng, days, 1)[0]
+    yield from block_frames([ '^' + market ], block, np.zeros((days, 1), dtype=bool))
+
+    for first in range(0, tickers, BLOCK):
+        width = min(BLOCK, tickers - first)
+        if kind == 'market':
+            block, missing = market_block(rng, days, width, index_returns)
+        else:
+            block, missing = (easy_block if kind == 'easy' else hard_block)(rng, days, width)
+        yield from block_frames([ f'S{k:05d}.{market}' for k in range(first, first + width) ], block, missing)
+
+def write(store, market, tickers, days, end=END, kind='market', seed=SEED):
+    """ Write a synthetic panel from frames() into the store, replacing the tickers' partitions. Returns the number of rows written. """
+    rows = 0
+    for (m, ticker), d in frames(market, tickers, days, end, kind, seed):
+        store.write_daily(m, ticker, d)
+        rows += len(d)
+    return rows
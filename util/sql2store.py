@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# Mirror the [stocks].[daily] table on the MSSQL server into the local Arrow store under data/store
+import os, sys, argparse
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/..')
+from lib.storage import SQLBackend, ArrowStore, STORE_DIR, partition
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', '--markets', default='AU,US', help='Comma-separated list of markets to export. Default : AU,US')
+parser.add_argument('-o', '--output', default=STORE_DIR, help='Store directory. Default: data/store')
+parser.add_argument('-w', '--where', default="date >= '1960-01-01'", help="SQL predicate to filter the exported rows with. Default: date >= '1960-01-01'")
+
+MARKETS = parser.parse_args().markets
+OUTPUT = parser.parse_args().output
+WHERE = parser.parse_args().where
+
+sql, store = SQLBackend(), ArrowStore(OUTPUT)
+
+for market in MARKETS.split(','):
+    data = partition(sql.read_daily([ market ], WHERE))
+    for (m, ticker), d in data.items():
+        store.write_daily(m, ticker, d)
+    print('sql2store.py:', market, '-', len(data), 'tickers,', sum(len(d) for d in data.values()), 'rows exported to', store.directory)
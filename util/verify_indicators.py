@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Check the vectorised indicators in lib/indicators.py and the online ones in lib/online.py against TA-Lib on random price data
+import os, sys, argparse
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/..')
+import numpy as np
+import talib as ta
+from lib.indicators import Indicators
+import lib.online as online
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--periods', default=1000, help='Length of the random price series. Default: 1000')
+parser.add_argument('-b', '--lookback', default=12, help='Longest ribbon period to check. Default: 12')
+parser.add_argument('-r', '--seed', default=6, help='Random seed. Default: 6')
+
+PERIODS = int(parser.parse_args().periods)
+LOOKBACK = int(parser.parse_args().lookback)
+SEED = int(parser.parse_args().seed)
+TOLERANCE = 1e-6 # relative. Results agree to within rounding, which ill-conditioned windows (e.g. BETA_2 over near-equal returns) amplify.
+
+def random_ohlcv(rng, n):
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    close[(n // 3):(n // 3 + 20)] = close[n // 3] # a flat stretch, for ties and zero ranges
+    open_ = close * np.exp(rng.normal(0, 0.01, n))
+    high = np.maximum(open_, close) * (1 + rng.random(n) * 0.02)
+    low = np.minimum(open_, close) * (1 - rng.random(n) * 0.02)
+    high[(n // 3):(n // 3 + 20)] = low[(n // 3):(n // 3 + 20)] = open_[(n // 3):(n // 3 + 20)] = close[n // 3]
+    volume = rng.integers(1000, 100000, n).astype('float64')
+    return open_, high, low, close, volume
+
+def same(expected, actual):
+    both_nan = np.isnan(expected) & np.isnan(actual)
+    close_enough = np.abs(expected - actual) <= TOLERANCE * np.maximum(1, np.abs(expected))
+    return bool((both_nan | close_enough).all())
+
+rng = np.random.default_rng(SEED)
+series = [ random_ohlcv(rng, PERIODS) for _ in range(3) ]
+panel = Indicators(*( np.stack([ s[c] for s in series ], axis=1) for c in range(5) ))
+
+failures = 0
+def check(name, expected, actual):
+    global failures
+    ok = same(expected, actual)
+    failures += not ok
+    if not ok:
+        print('MISMATCH', name, np.nanmax(np.abs(expected - actual)))
+
+for column, (o, h, l, c, v) in enumerate(series):
+    for i in range(2, LOOKBACK + 1):
+        check(f'AROONOSC_{i}', ta.AROONOSC(h, l, timeperiod=i), panel.AROONOSC(i)[:, column])
+        check(f'ATR_{i}', ta.ATR(h, l, c, timeperiod=i), panel.ATR(i)[:, column])
+        check(f'CORREL_{i}', ta.CORREL(h, l, timeperiod=i), panel.CORREL(i)[:, column])
+        check(f'BETA_{i}', ta.BETA(h, l, timeperiod=i), panel.BETA(i)[:, column])
+        check(f'CMO_{i}', ta.CMO(c, timeperiod=i), panel.CMO(i)[:, column])
+        check(f'CCI_{i}', ta.CCI(h, l, c, timeperiod=i), panel.CCI(i)[:, column])
+        check(f'LINEARREG_SLOPE_close_{i}', ta.LINEARREG_SLOPE(c, timeperiod=i), panel.LINEARREG_SLOPE(panel.close, i)[:, column])
+        check(f'LINEARREG_SLOPE_volume_{i}', ta.LINEARREG_SLOPE(v, timeperiod=i), panel.LINEARREG_SLOPE(panel.volume, i)[:, column])
+        if i >= 6:
+            j = int(round(i * 3 / 5))
+            check(f'STOCHF_K_{i}', ta.STOCHF(h, l, c, fastk_period=i, fastd_period=j)[0], panel.STOCHF_K(i, j)[:, column])
+            slowk, slowd = ta.STOCH(h, l, c, fastk_period=i, slowk_period=j, slowd_period=j)
+            k, d = panel.STOCH(i, j, j)
+            check(f'STOCH_K_{i}', slowk, k[:, column])
+            check(f'STOCH_D_{i}', slowd, d[:, column])
+            check(f'ULTOSC_{i}', ta.ULTOSC(h, l, c, timeperiod1=int(round(i / 3)), timeperiod2=int(round(i / 2)), timeperiod3=i), panel.ULTOSC(int(round(i / 3)), int(round(i / 2)), i)[:, column])
+            check(f'ADOSC_{i}', ta.ADOSC(h, l, c, v, fastperiod=int(round(i * 3 / 10)), slowperiod=i), panel.ADOSC(int(round(i * 3 / 10)), i)[:, column])
+
+# online indicators are seeded with the first half of the history, then updated one bar at a time over the rest
+SEEDED = PERIODS // 2
+o, h, l, c, v = ( np.stack([ s[k] for s in series ], axis=1) for k in range(5) )
+
+def check_online(name, expected, indicator, output=None):
+    """ expected: (time x tickers) TA-Lib outputs """
+    pick = (lambda x: x) if output is None else (lambda x: x[output])
+    values = [ pick(indicator.seed(o[:SEEDED], h[:SEEDED], l[:SEEDED], c[:SEEDED], v[:SEEDED])) ]
+    values += [ pick(indicator.update(o[t], h[t], l[t], c[t], v[t])) for t in range(SEEDED, PERIODS) ]
+    check('online ' + name, expected[(SEEDED - 1):], np.array(values))
+
+def talib(function, *args, **kwargs):
+    outputs = [ function(*( x[:, k] for x in args ), **kwargs) for k in range(len(series)) ]
+    if isinstance(outputs[0], tuple):
+        return tuple(np.stack([ out[j] for out in outputs ], axis=1) for j in range(len(outputs[0])))
+    return np.stack(outputs, axis=1)
+
+for i in range(2, LOOKBACK + 1):
+    check_online(f'AROONOSC_{i}', talib(ta.AROONOSC, h, l, timeperiod=i), online.AROONOSC(i))
+    check_online(f'ATR_{i}', talib(ta.ATR, h, l, c, timeperiod=i), online.ATR(i))
+    check_online(f'CORREL_{i}', talib(ta.CORREL, h, l, timeperiod=i), online.CORREL(i))
+    check_online(f'BETA_{i}', talib(ta.BETA, h, l, timeperiod=i), online.BETA(i))
+    check_online(f'CMO_{i}', talib(ta.CMO, c, timeperiod=i), online.CMO(i))
+    check_online(f'CCI_{i}', talib(ta.CCI, h, l, c, timeperiod=i), online.CCI(i))
+    check_online(f'LINEARREG_SLOPE_close_{i}', talib(ta.LINEARREG_SLOPE, c, timeperiod=i), online.LINEARREG_SLOPE(i))
+    check_online(f'LINEARREG_SLOPE_volume_{i}', talib(ta.LINEARREG_SLOPE, v, timeperiod=i), online.LINEARREG_SLOPE(i, 'volume'))
+    if i >= 6:
+        j = int(round(i * 3 / 5))
+        check_online(f'STOCHF_K_{i}', talib(ta.STOCHF, h, l, c, fastk_period=i, fastd_period=j)[0], online.STOCHF_K(i, j))
+        slowk, slowd = talib(ta.STOCH, h, l, c, fastk_period=i, slowk_period=j, slowd_period=j)
+        check_online(f'STOCH_K_{i}', slowk, online.STOCH(i, j, j), 0)
+        check_online(f'STOCH_D_{i}', slowd, online.STOCH(i, j, j), 1)
+        check_online(f'ULTOSC_{i}', talib(ta.ULTOSC, h, l, c, timeperiod1=int(round(i / 3)), timeperiod2=int(round(i / 2)), timeperiod3=i), online.ULTOSC(int(round(i / 3)), int(round(i / 2)), i))
+        check_online(f'ADOSC_{i}', talib(ta.ADOSC, h, l, c, v, fastperiod=int(round(i * 3 / 10)), slowperiod=i), online.ADOSC(int(round(i * 3 / 10)), i))
+check_online('MFI', talib(ta.MFI, h, l, c, v), online.MFI())
+check_online('BOP', talib(ta.BOP, o, h, l, c), online.BOP())
+
+print('verify_indicators.py:', 'all indicators match TA-Lib' if failures == 0 else f'{failures} mismatches')
+sys.exit(1 if failures else 0)
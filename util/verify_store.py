@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Check that a DataSet built from the Arrow store keeps a delisted ticker, and that builds with and without the feature cache are equal
+import os, sys, argparse, tempfile
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/..')
+import pandas as pd
+import lib.synthetic as synthetic
+import lib.storage as storage
+import lib.tickers as ticker_lists
+from lib.feature_cache import FeatureCache
+from dataset import DataSet
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--tickers', default=5, help='Number of synthetic tickers. Default: 5')
+parser.add_argument('-d', '--days', default=1000, help='Number of trading days of synthetic data. Default: 1000')
+parser.add_argument('-w', '--resample', default='no', help='Resampling window size. Default: no')
+
+TICKERS = int(parser.parse_args().tickers)
+DAYS = int(parser.parse_args().days)
+RESAMPLE = parser.parse_args().resample
+
+MARKET = 'SY'
+DELISTED = f'S00000.{MARKET}'
+pd.set_option('mode.chained_assignment', None)
+
+failures = 0
+def check(name, ok):
+    global failures
+    failures += not ok
+    if not ok:
+        print('FAILED', name)
+
+with tempfile.TemporaryDirectory() as directory:
+    # a synthetic market in which the first ticker stops trading a third of the way before the index does
+    store = storage.ArrowStore(directory + '/store')
+    for (market, ticker), d in synthetic.frames(MARKET, TICKERS, DAYS):
+        store.write_daily(market, ticker, d.iloc[:(2 * len(d) // 3)] if ticker == DELISTED else d)
+    storage.use('arrow', store.directory)
+    tickers = ticker_lists.by_market([ MARKET ])
+
+    FeatureCache.__init__.__defaults__ = FeatureCache.__init__.__defaults__[:-1] + (directory + '/cache',)
+    build = lambda feature_cache: DataSet(tickers=tickers, lookback=6, lookfwd=1, resample=RESAMPLE, feature_cache=feature_cache).data
+    uncached, cold, warm = build(False), build(True), build(True) # the second cached build reads the features the first one wrote
+
+    delisted = uncached.xs(f'{MARKET}_{DELISTED}', level='ticker', drop_level=False) if f'{MARKET}_{DELISTED}' in uncached.index.get_level_values('ticker') else uncached.iloc[:0]
+    check('delisted ticker kept', len(delisted) > 0)
+    check('delisted ticker ends early', len(delisted) == 0 or delisted.index.get_level_values('date').max() < uncached.index.get_level_values('date').max())
+    for name, data in (('cold cache', cold), ('warm cache', warm)):
+        try:
+            pd.testing.assert_frame_equal(uncached, data, check_exact=False, rtol=1e-9)
+        except AssertionError as e:
+            check(f'{name} build equals the uncached one: {e}', False)
+
+print('verify_store.py:', 'cached and uncached builds match' if failures == 0 else f'{failures} failures')
+sys.exit(1 if failures else 0)